@@ -0,0 +1,105 @@
+"""End-to-end crawl benchmark against a synthetic local site.
+
+Usage: python bench_crawl.py [--engines http,auto] [--concurrency 8] [--products 40] ...
+
+Starts fixture_site.py's server, then runs newpy.main() once per engine and
+concurrency in a fresh subprocess and working directory, and prints products/s,
+peak RSS and wall time for each run. Nothing touches capraleo.com.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from fixture_site import add_spec_arguments, spec_from_arguments, start_server
+
+RESULT_PREFIX = 'BENCH_RESULT '
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB, or None where it cannot be read."""
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return psutil.Process().memory_info().peak_wset / 1e6  # Windows
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1e6 if sys.platform == 'darwin' else peak / 1e3  # bytes on macOS, KB on Linux
+
+
+def run_child():
+    """Run one crawl in this process (configured through the environment) and print its result."""
+    import newpy
+    from metrics import metrics
+
+    newpy.main()
+    summary = metrics.summary()
+    print(RESULT_PREFIX + json.dumps({'summary': summary, 'peak_rss_mb': peak_rss_mb()}))
+
+
+def run_crawl(base_url, engine, concurrency, args):
+    """Crawl the fixture site in a subprocess and return its wall time, summary and peak RSS."""
+    env = dict(os.environ, CAPRALEO_BASE_URL=base_url, SCRAPER_ENGINE=engine,
+               SCRAPER_CONCURRENCY=str(concurrency), SCRAPER_PER_HOST=str(args.per_host),
+               SCRAPER_RATE=str(args.rate), SCRAPER_DISCOVERY=args.discovery, SCRAPER_INGEST=args.ingest,
+               SCRAPER_LOG_FORMAT='text')
+    with tempfile.TemporaryDirectory(prefix='bench_crawl_') as workdir:
+        started = time.perf_counter()
+        completed = subprocess.run([sys.executable, os.path.abspath(__file__), '--child'], cwd=workdir, env=env,
+                                   stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        wall = time.perf_counter() - started
+    for line in completed.stdout.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            result = json.loads(line[len(RESULT_PREFIX):])
+            result['wall_s'] = wall
+            return result
+    print(completed.stdout[-2000:])
+    raise RuntimeError(f"Crawl with engine {engine} exited with {completed.returncode} and no result")
+
+
+def main():
+    if '--child' in sys.argv:
+        run_child()
+        return
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--engines', default='http', help='comma separated SCRAPER_ENGINE values (http, auto, browser)')
+    parser.add_argument('--concurrency', default='8', help='comma separated SCRAPER_CONCURRENCY values')
+    parser.add_argument('--per-host', type=int, default=8)
+    parser.add_argument('--rate', type=float, default=1000.0, help='requests/s per host; local runs need no politeness')
+    parser.add_argument('--discovery', default='html', help='SCRAPER_DISCOVERY (html walks the listing pages)')
+    parser.add_argument('--ingest', default='html', help='SCRAPER_INGEST')
+    add_spec_arguments(parser)
+    args = parser.parse_args()
+
+    spec = spec_from_arguments(args)
+    server, base_url = start_server(spec)
+    print(f"Fixture site at {base_url}: {spec.categories} categories x {spec.products} products, "
+          f"{spec.latency * 1000:.0f} ms latency, {spec.error_rate:.0%} errors")
+    print(f"{'engine':<10} {'conc':>5} {'products':>9} {'wall s':>8} {'products/s':>11} {'pages/s':>8} {'peak MB':>8}")
+    try:
+        for engine in args.engines.split(','):
+            for concurrency in (int(value) for value in args.concurrency.split(',')):
+                try:
+                    result = run_crawl(base_url, engine, concurrency, args)
+                except Exception as e:
+                    print(f"{engine:<10} {concurrency:>5} failed: {e}")
+                    continue
+                summary = result['summary']
+                products = summary['counters'].get('products', 0)
+                peak = result['peak_rss_mb']
+                print(f"{engine:<10} {concurrency:>5} {products:>9} {result['wall_s']:>8.2f} "
+                      f"{products / result['wall_s']:>11.2f} {summary['pages_per_s']:>8.2f} "
+                      f"{'n/a' if peak is None else f'{peak:.1f}':>8}")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
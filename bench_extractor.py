@@ -0,0 +1,69 @@
+"""Micro-benchmark of product page parsing cost.
+
+Usage: python bench_extractor.py [page.html ...] [--iterations N]
+
+Defaults to the saved pages in fixtures/. Prints the mean milliseconds per page
+for each extractor backend and for the old BeautifulSoup tree + find() approach.
+"""
+import argparse
+import glob
+import time
+
+from extractor import etree, extract_product
+
+
+def soup_find_all_fields(html):
+    """The pre-extractor approach: build a full html.parser tree, then scan it once per field."""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, 'html.parser')
+    price_element = soup.find(class_='woocommerce-Price-amount')
+    if price_element:
+        price_element.find(class_='woocommerce-Price-currencySymbol')
+        price_element.find('bdi')
+    description_div = soup.find('div', id='tab-description')
+    if description_div:
+        description_div.find('p')
+    for selector in ('single-product-category', 'product_title entry-title', 'sku_wrapper', 'sku',
+                     'woocommerce-product-attributes-item__value'):
+        soup.find(class_=selector)
+    soup.find('img', class_='wp-post-image')
+
+
+def time_per_page(parse, pages, iterations):
+    """Return the mean wall time in milliseconds of parse() over every page."""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for html in pages:
+            parse(html)
+    return (time.perf_counter() - start) * 1000 / (iterations * len(pages))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('pages', nargs='*', help='saved product page HTML files')
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    paths = args.pages or sorted(glob.glob('fixtures/*.html'))
+    pages = []
+    for path in paths:
+        with open(path, encoding='utf-8') as file:
+            pages.append(file.read())
+    print(f"{len(pages)} pages, {sum(map(len, pages)) // len(pages)} bytes on average, {args.iterations} iterations")
+
+    candidates = {'extractor (html.parser)': lambda html: extract_product(html, backend='html.parser')}
+    if etree is not None:
+        candidates['extractor (lxml)'] = lambda html: extract_product(html, backend='lxml')
+    try:
+        import bs4  # noqa: F401
+        candidates['bs4 tree + find()'] = soup_find_all_fields
+    except ImportError:
+        pass
+
+    for name, parse in candidates.items():
+        print(f"{name:<26} {time_per_page(parse, pages, args.iterations):8.3f} ms/page")
+
+
+if __name__ == "__main__":
+    main()
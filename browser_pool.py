@@ -0,0 +1,213 @@
+import queue
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from metrics import log
+
+# Seconds before driver.get() gives up on a page that never finishes loading
+PAGE_LOAD_TIMEOUT = 30
+
+# Requests a lean browser never makes: we only read page_source, and images are downloaded separately
+BLOCKED_URL_PATTERNS = (
+    '*.png', '*.jpg', '*.jpeg', '*.gif', '*.webp', '*.avif', '*.svg', '*.ico',  # Images
+    '*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot',  # Fonts
+    '*.mp4', '*.webm', '*.mp3', '*.ogg', '*.m4a',  # Media
+    '*.css',
+    '*google-analytics.com*', '*googletagmanager.com*', '*doubleclick.net*', '*facebook.net*',
+    '*facebook.com/tr*', '*hotjar.com*', '*clarity.ms*', '*fonts.googleapis.com*', '*fonts.gstatic.com*',
+    '*youtube.com*', '*vimeo.com*', '*gravatar.com*',
+)
+
+
+def build_chrome_options(lean=False):
+    """Build the headless Chrome options used for every browser session.
+
+    `lean` stops waiting for subresources once the DOM is ready (the eager page
+    load strategy) and turns off image loading.
+    """
+    import undetected_chromedriver as uc
+
+    options = uc.ChromeOptions()
+    options.add_argument("--headless=new")  # Enable new headless mode
+    options.add_argument("--disable-gpu")  # Disable GPU usage
+    options.add_argument("--disable-extensions")  # Disable extensions
+    options.add_argument("--no-sandbox")  # Disable sandbox mode for security
+    options.add_argument("--disable-dev-shm-usage")  # Prevents issues on systems with low memory
+    options.add_argument("--disable-blink-features=AutomationControlled")  # Avoid detection as automated
+    if lean:
+        options.page_load_strategy = 'eager'  # driver.get() returns at DOMContentLoaded
+        options.add_argument("--blink-settings=imagesEnabled=false")
+        options.add_experimental_option('prefs', {'profile.managed_default_content_settings.images': 2})
+    return options
+
+
+class PooledDriver:
+    """A Chrome driver plus the bookkeeping the pool needs to decide when to recycle it."""
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.pages = 0
+        self.broken = False
+
+
+def start_chrome(options_factory=build_chrome_options, page_load_timeout=PAGE_LOAD_TIMEOUT, lean=False,
+                 blocked_urls=()):
+    """Start one headless undetected Chrome with the shared options.
+
+    A `lean` browser also blocks images, fonts, media, stylesheets and the
+    trackers in BLOCKED_URL_PATTERNS (plus `blocked_urls`) through CDP, so a
+    page load only fetches the HTML and the scripts that render it.
+    """
+    import undetected_chromedriver as uc
+
+    driver = uc.Chrome(options=options_factory(lean=lean) if lean else options_factory())
+    driver.set_page_load_timeout(page_load_timeout)  # A hung page raises instead of stalling the crawl
+    if lean:
+        driver.execute_cdp_cmd('Network.enable', {})
+        driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': list(BLOCKED_URL_PATTERNS) + list(blocked_urls)})
+    return driver
+
+
+class BrowserPool:
+    """Keep up to `size` long-lived Chrome drivers and lend them out one caller at a time.
+
+    A driver is recycled after it crashes, fails a health check or has served
+    `max_pages` pages, which keeps Chrome's memory growth bounded on long crawls.
+    """
+
+    def __init__(self, size=2, max_pages=200, driver_factory=start_chrome):
+        self.size = size
+        self.max_pages = max_pages
+        self.driver_factory = driver_factory
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _acquire(self, timeout):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+            with self._lock:
+                create = self._created < self.size
+                if create:
+                    self._created += 1
+            if create:
+                try:
+                    worker = PooledDriver(self.driver_factory())
+                    log('browser_started', f"Started browser {self._created}/{self.size} in the pool.")
+                    return worker
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            # Wake up periodically in case a recycled driver freed a slot
+            wait = 1 if deadline is None else min(1, deadline - time.monotonic())
+            if wait <= 0:
+                raise queue.Empty("No browser became available in time")
+            try:
+                return self._idle.get(timeout=wait)
+            except queue.Empty:
+                continue
+
+    def _release(self, worker):
+        worker.pages += 1
+        if worker.broken:
+            reason = 'crashed'
+        elif worker.pages >= self.max_pages:
+            reason = f'served {worker.pages} pages'
+        elif not self._closed and not self.healthy(worker.driver):
+            reason = 'failed its health check'
+        else:
+            reason = None
+
+        if reason or self._closed:
+            if reason:
+                log('browser_recycled', f"Recycling browser that {reason}.", reason=reason)
+            self._discard(worker)
+        else:
+            self._idle.put(worker)
+
+    def _discard(self, worker):
+        try:
+            worker.driver.quit()
+        except Exception as e:
+            log('browser_error', f"Failed to quit driver: {e}", error=str(e))
+        with self._lock:
+            self._created -= 1
+
+    @staticmethod
+    def healthy(driver):
+        """Check that the browser process still answers commands."""
+        try:
+            driver.execute_script('return 1')
+            return True
+        except Exception:
+            return False
+
+    @contextmanager
+    def checkout(self, timeout=None):
+        """Borrow a driver for the duration of the `with` block."""
+        from selenium.common.exceptions import TimeoutException, WebDriverException
+
+        worker = self._acquire(timeout)
+        try:
+            yield worker.driver
+        except TimeoutException:
+            raise
+        except WebDriverException:
+            worker.broken = True
+            raise
+        finally:
+            self._release(worker)
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+
+def steal_work(groups, worker_count, handler):
+    """Run handler(key, task) over grouped tasks with one thread per worker.
+
+    Each worker starts on its own share of the groups and, once its queue is
+    empty, steals tasks from the back of the busiest other worker, so one large
+    subcategory does not leave the other browsers idle.
+    """
+    queues = [deque() for _ in range(worker_count)]
+    for index, (key, tasks) in enumerate(groups.items()):
+        queues[index % worker_count].extend((key, task) for task in tasks)
+
+    def next_task(own):
+        try:
+            return queues[own].popleft()
+        except IndexError:
+            pass
+        for victim in sorted(range(worker_count), key=lambda i: len(queues[i]), reverse=True):
+            try:
+                return queues[victim].pop()
+            except IndexError:
+                continue
+        return None
+
+    def run(own):
+        while (item := next_task(own)) is not None:
+            key, task = item
+            try:
+                handler(key, task)
+            except Exception as e:
+                log('task_error', f"Error processing {task}: {e}", task=task, error=str(e))
+
+    threads = [threading.Thread(target=run, args=(i,), daemon=True) for i in range(worker_count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
@@ -0,0 +1 @@
+# Lets pytest import the flat root modules (newpy, discovery, ...) from tests/
@@ -0,0 +1,153 @@
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from metrics import metrics
+
+
+def _parse_batch(items):
+    """Worker side: extract a record from each (html, url, fields), returning (record, error, seconds)."""
+    from extractor import PRODUCT_FIELDS, extract_product
+
+    results = []
+    for html, url, fields in items:
+        started = time.perf_counter()
+        try:
+            results.append((extract_product(html, url, fields or PRODUCT_FIELDS), None, time.perf_counter() - started))
+        except Exception as e:
+            results.append((None, str(e), time.perf_counter() - started))
+    return results
+
+
+def _thumbnail_batch(items):
+    """Worker side: hash and thumbnail each (image bytes, sizes, directory, extension).
+
+    Returns ((signature, {size name: path}), error, seconds) per image.
+    """
+    from images import make_thumbnails
+
+    results = []
+    for data, sizes, directory, extension in items:
+        started = time.perf_counter()
+        try:
+            results.append((make_thumbnails(data, sizes, directory, extension), None, time.perf_counter() - started))
+        except Exception as e:
+            results.append((None, str(e), time.perf_counter() - started))
+    return results
+
+
+class _Batcher:
+    """Jobs collected for one worker function, waiting to be sent as a chunk."""
+
+    def __init__(self, function, stage, max_pending):
+        self.function = function
+        self.stage = stage
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.items = []
+        self.futures = []
+        self.started = None
+
+    def add(self, item):
+        future = Future()
+        self.items.append(item)
+        self.futures.append(future)
+        self.started = self.started or time.monotonic()
+        return future
+
+    def take(self):
+        items, futures = self.items, self.futures
+        self.items, self.futures, self.started = [], [], None
+        return items, futures
+
+
+class CpuPool:
+    """Run product parsing and thumbnailing in worker processes, past the GIL.
+
+    Jobs are collected into chunks of `chunk_size` (or whatever has waited
+    `linger` seconds) so each round trip to a worker carries many pages or
+    images. At most `max_pending` jobs of each kind are queued or running at
+    once; submit calls block beyond that, which keeps fast fetchers from piling
+    up pages in memory. parse() and thumbnails() return Futures resolving to a
+    ProductRecord or (image signature, thumbnail paths), and raise the
+    worker's error.
+    """
+
+    def __init__(self, workers=None, chunk_size=16, linger=0.05, max_pending=None):
+        self.workers = workers or multiprocessing.cpu_count()
+        self.chunk_size = chunk_size
+        self.linger = linger
+        self.max_pending = max_pending or self.workers * chunk_size * 2
+        # spawn: worker processes must not inherit the crawler's threads and sockets
+        self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+        self._condition = threading.Condition()
+        self._batchers = {
+            'parse': _Batcher(_parse_batch, 'parse.product', self.max_pending),
+            'thumbnail': _Batcher(_thumbnail_batch, 'image.thumbnail', self.max_pending),
+        }
+        self._closed = False
+        self._flusher = threading.Thread(target=self._flush_lingering, name='cpu-pool-flush', daemon=True)
+        self._flusher.start()
+
+    def _add(self, kind, item):
+        batcher = self._batchers[kind]
+        batcher.slots.acquire()
+        with self._condition:
+            future = batcher.add(item)
+            if len(batcher.items) >= self.chunk_size:
+                self._submit(batcher)
+            else:
+                self._condition.notify()
+        return future
+
+    def parse(self, html, url=None, fields=None):
+        return self._add('parse', (html, url, fields))
+
+    def thumbnails(self, data, sizes, directory, extension='.png'):
+        return self._add('thumbnail', (data, sizes, directory, extension))
+
+    def _submit(self, batcher):
+        """Send a batcher's jobs as one task; each job's Future resolves when the chunk comes back."""
+        items, futures = batcher.take()
+        if not items:
+            return
+        try:
+            task = self._executor.submit(batcher.function, items)
+        except Exception as e:  # The pool is broken or shut down
+            task = Future()
+            task.set_exception(e)
+        task.add_done_callback(lambda done: self._resolve(batcher, futures, done))
+
+    def _resolve(self, batcher, futures, done):
+        try:
+            results = done.result()
+        except Exception as e:  # A worker process died
+            results = [(None, str(e), 0.0)] * len(futures)
+        for future, (result, error, seconds) in zip(futures, results):
+            metrics.record(batcher.stage, seconds)
+            batcher.slots.release()
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(RuntimeError(error))
+
+    def _flush_lingering(self):
+        """Send partial chunks that have waited `linger` seconds."""
+        with self._condition:
+            while not self._closed:
+                waiting = [batcher for batcher in self._batchers.values() if batcher.started is not None]
+                now = time.monotonic()
+                for batcher in waiting:
+                    if now - batcher.started >= self.linger:
+                        self._submit(batcher)
+                waiting = [batcher.started for batcher in self._batchers.values() if batcher.started is not None]
+                self._condition.wait(max(0.001, min(waiting) + self.linger - now) if waiting else None)
+
+    def close(self):
+        with self._condition:
+            for batcher in self._batchers.values():
+                self._submit(batcher)
+            self._closed = True
+            self._condition.notify()
+        self._flusher.join()
+        self._executor.shutdown(wait=True)
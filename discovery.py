@@ -0,0 +1,186 @@
+import html
+import json
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass, field
+from decimal import Decimal
+from urllib.parse import urljoin, urlsplit
+
+from extractor import FieldSelector, ProductRecord, collect_fields
+from metrics import log
+
+STORE_API_PATHS = ('wp-json/wc/store/v1/products', 'wp-json/wc/store/products')
+SITEMAP_NS = '{http://www.sitemaps.org/schemas/sitemap/0.9}'
+
+# Fields a Store API record must have before we trust it over the product page
+JSON_REQUIRED_FIELDS = ('title', 'price', 'sku')
+DESCRIPTION_FIELDS = (FieldSelector('description', tag='p'),)
+
+
+@dataclass
+class Catalog:
+    """What discovery learned about the site.
+
+    `products` only has entries for categories whose membership is known;
+    categories missing from it are still listed page by page.
+    """
+    source: str = 'html'
+    category_links: dict = field(default_factory=dict)  # category slug -> category URL
+    products: dict = field(default_factory=dict)  # category slug -> [product URL]
+    items: dict = field(default_factory=dict)  # product URL -> Store API JSON
+
+
+def category_slug(link):
+    """Slug of a category URL, e.g. .../product-category/general/forceps/ -> forceps."""
+    return [part for part in urlsplit(link).path.split('/') if part][-1]
+
+
+def iter_store_api(fetcher, url, per_page=100):
+    """Yield every item of a paginated Store API collection."""
+    page = 1
+    previous_first = None
+    while True:
+        separator = '&' if '?' in url else '?'
+        result = fetcher.fetch(f"{url}{separator}per_page={per_page}&page={page}")
+        items = json.loads(result.text)
+        # Stop on an empty page, or when an endpoint ignores `page` and repeats itself
+        if not items or items[0] == previous_first:
+            return
+        previous_first = items[0]
+        yield from items
+        total_pages = result.headers.get('X-WP-TotalPages')
+        if (total_pages and page >= int(total_pages)) or (not total_pages and len(items) < per_page):
+            return
+        page += 1
+
+
+def discover_from_store_api(fetcher, base_url):
+    """List every product and its categories (including parent categories) through the Store API."""
+    for path in STORE_API_PATHS:
+        api_url = urljoin(base_url, path)
+        try:
+            categories = {category['id']: category for category in iter_store_api(fetcher, f"{api_url}/categories")}
+            break
+        except Exception as e:
+            log('discovery', f"Store API not available at {api_url}: {e}", url=api_url, error=str(e))
+    else:
+        return None
+
+    catalog = Catalog(source='store-api')
+    for category in categories.values():
+        if category.get('permalink'):
+            catalog.category_links[category['slug']] = category['permalink']
+
+    for item in iter_store_api(fetcher, api_url):
+        url = item['permalink']
+        catalog.items[url] = item
+        slugs = []
+        # A category page also lists the products of its subcategories
+        for category in item.get('categories', []):
+            category_id = category['id']
+            while category_id and category_id in categories and categories[category_id]['slug'] not in slugs:
+                slugs.append(categories[category_id]['slug'])
+                category_id = categories[category_id].get('parent')
+        for slug in slugs:
+            catalog.products.setdefault(slug, []).append(url)
+
+    log('discovery', f"Store API listed {len(catalog.items)} products in {len(catalog.products)} categories",
+        source=catalog.source, products=len(catalog.items), categories=len(catalog.products))
+    return catalog
+
+
+def sitemap_locations(fetcher, url):
+    """Return the <loc> entries of a sitemap or sitemap index."""
+    root = ET.fromstring(fetcher.fetch(url).text.encode('utf-8'))
+    return [loc.text.strip() for loc in root.iter(f'{SITEMAP_NS}loc') if loc.text]
+
+
+def discover_from_sitemap(fetcher, base_url):
+    """Read the product category sitemaps; product membership is left to the listing pages."""
+    for index in ('wp-sitemap.xml', 'sitemap_index.xml'):
+        try:
+            sitemaps = sitemap_locations(fetcher, urljoin(base_url, index))
+            break
+        except Exception as e:
+            log('discovery', f"No sitemap at {urljoin(base_url, index)}: {e}",
+                url=urljoin(base_url, index), error=str(e))
+    else:
+        return None
+
+    catalog = Catalog(source='sitemap')
+    for sitemap in sitemaps:
+        # WordPress core names it wp-sitemap-taxonomies-product_cat-1.xml, Yoast product_cat-sitemap.xml
+        if 'product_cat' not in sitemap:
+            continue
+        for link in sitemap_locations(fetcher, sitemap):
+            catalog.category_links.setdefault(category_slug(link), link)
+
+    log('discovery', f"Sitemap listed {len(catalog.category_links)} categories",
+        source=catalog.source, categories=len(catalog.category_links))
+    return catalog if catalog.category_links else None
+
+
+def discover_catalog(fetcher, base_url, strategy='auto'):
+    """Discover categories and products in a few bulk requests, falling back to plain HTML crawling.
+
+    `strategy` is 'store-api', 'sitemap', 'html' or 'auto' (try them in that order).
+    `fetcher` should be a plain HTTP fetcher: these are JSON and XML documents.
+    """
+    strategies = {'store-api': discover_from_store_api, 'sitemap': discover_from_sitemap}
+    names = list(strategies) if strategy == 'auto' else [name for name in (strategy,) if name in strategies]
+    for name in names:
+        try:
+            catalog = strategies[name](fetcher, base_url)
+        except Exception as e:
+            log('discovery', f"Discovery through {name} failed: {e}", source=name, error=str(e))
+            continue
+        if catalog is not None:
+            return catalog
+    return Catalog()
+
+
+def format_store_price(prices):
+    """Format Store API prices like the product page does: symbol, then the <bdi> text."""
+    raw = prices.get('price')
+    if raw in (None, ''):
+        return None
+    minor_unit = prices.get('currency_minor_unit', 2)
+    whole, _, fraction = f"{Decimal(int(raw)).scaleb(-minor_unit):.{minor_unit}f}".partition('.')
+    amount = f"{int(whole):,}".replace(',', prices.get('currency_thousand_separator', ','))
+    if minor_unit:
+        amount += prices.get('currency_decimal_separator', '.') + fraction
+    symbol = html.unescape(prices.get('currency_symbol', ''))
+    prefix = html.unescape(prices.get('currency_prefix', ''))
+    suffix = html.unescape(prices.get('currency_suffix', ''))
+    return f"{symbol} {prefix}{amount}{suffix}"
+
+
+def record_from_store_item(item):
+    """Build the ProductRecord the product page would give, from one Store API product."""
+    record = ProductRecord(url=item.get('permalink'))
+    if item.get('categories'):
+        record.category = html.unescape(item['categories'][0]['name'])
+    if item.get('name'):
+        record.title = html.unescape(item['name'])
+    prices = item.get('prices') or {}
+    price = format_store_price(prices)
+    if price:
+        record.price = price
+        record.currency = html.unescape(prices.get('currency_symbol', ''))
+    if item.get('sku'):
+        # The page shows "SKU: <sku>" in .sku_wrapper, and the scraper appends the .sku text again
+        record.sku = f"SKU:{item['sku']} {item['sku']}"
+    description = collect_fields(item.get('description') or '', DESCRIPTION_FIELDS).get('description')
+    if description:
+        record.description = ''.join(description)
+    for attribute in item.get('attributes') or []:
+        if attribute.get('terms'):
+            record.size = ', '.join(html.unescape(term['name']) for term in attribute['terms'])
+            break
+    if item.get('images'):
+        record.image_url = item['images'][0]['src']
+    return record.intern()
+
+
+def is_complete(record):
+    """True when a JSON-built record has every field we would otherwise fetch the page for."""
+    return all(getattr(record, name) != 'N/A' for name in JSON_REQUIRED_FIELDS)
@@ -0,0 +1,60 @@
+"""Build image-embedded Excel workbooks from JSONL, CSV or Parquet crawl outputs.
+
+Usage: python export.py general_product_data.jsonl [more outputs ...] [--output general.xlsx]
+                        [--thumbnail-size 300x300]
+
+Each input becomes a workbook next to it (or at --output for a single input),
+laid out like the crawler's own Excel output. Thumbnails come from the image
+cache, so only images never downloaded before are fetched; --thumbnail-size
+embeds another of the sizes the crawl made (SCRAPER_THUMBNAIL_SIZES).
+"""
+import argparse
+import os
+
+from images import ImageStage, parse_sizes
+from metrics import log
+from sinks import ExcelSink, read_rows, record_of
+
+
+def export_excel(source_path, excel_path=None, images=None):
+    """Write the rows of one output file to an Excel workbook with embedded thumbnails; return its path."""
+    base = os.path.splitext(source_path)[0]
+    excel_path = excel_path or base + ExcelSink.extension
+    sheet_name = os.path.basename(base).removesuffix('_product_data') + ' Data'
+    own_images = images is None
+    images = images or ImageStage()
+    rows = 0
+    try:
+        with ExcelSink(excel_path, sheet_name, recover=False) as sink:
+            for row in read_rows(source_path):
+                record = record_of(row)
+                sink.write(record, images.submit(record.image_url))
+                rows += 1
+    finally:
+        if own_images:
+            images.close()
+    log('export', f"Exported {rows} rows from {source_path} to {excel_path}", source=source_path, path=excel_path,
+        rows=rows)
+    return excel_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('sources', nargs='+', help='.jsonl, .csv or .parquet outputs of a crawl')
+    parser.add_argument('--output', help='workbook path, for a single source')
+    parser.add_argument('--image-workers', type=int, default=4)
+    parser.add_argument('--thumbnail-size', default='100x100', help='size of the embedded thumbnails, e.g. 300x300')
+    args = parser.parse_args()
+    if args.output and len(args.sources) > 1:
+        parser.error('--output needs exactly one source')
+
+    images = ImageStage(workers=args.image_workers, sizes=parse_sizes(args.thumbnail_size))
+    try:
+        for source in args.sources:
+            export_excel(source, args.output, images)
+    finally:
+        images.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+import sys
+from dataclasses import dataclass
+from html.parser import HTMLParser
+
+try:
+    from lxml import etree
+except ImportError:  # lxml is optional, the stdlib parser does the same job a little slower
+    etree = None
+
+# Elements that never have a closing tag, so html.parser never reports one
+VOID_TAGS = frozenset(['area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source', 'track', 'wbr'])
+
+
+@dataclass(frozen=True)
+class FieldSelector:
+    """Where to find one product field in the page.
+
+    `class_` matches elements carrying that class, or the exact class attribute
+    when it contains spaces (the same rule as BeautifulSoup's class_ filter).
+    `within` restricts matches to the inside of another field's element, and
+    `attr` takes an attribute value instead of the element's text.
+    """
+    name: str
+    tag: str = None
+    class_: str = None
+    id: str = None
+    within: str = None
+    attr: str = None
+
+    def matches(self, tag, attrs):
+        if self.tag and tag != self.tag:
+            return False
+        if self.id and attrs.get('id') != self.id:
+            return False
+        if self.class_:
+            classes = attrs.get('class') or ''
+            if ' ' in self.class_:
+                return classes == self.class_
+            return self.class_ in classes.split()
+        return True
+
+
+PRODUCT_FIELDS = (
+    FieldSelector('category', class_='single-product-category'),
+    FieldSelector('title', class_='product_title entry-title'),
+    FieldSelector('price', class_='woocommerce-Price-amount'),
+    FieldSelector('currency', class_='woocommerce-Price-currencySymbol', within='price'),
+    FieldSelector('amount', tag='bdi', within='price'),
+    FieldSelector('sku_wrapper', class_='sku_wrapper'),
+    FieldSelector('sku', class_='sku'),
+    FieldSelector('description_block', tag='div', id='tab-description'),
+    FieldSelector('description', tag='p', within='description_block'),
+    FieldSelector('size', class_='woocommerce-product-attributes-item__value'),
+    FieldSelector('image', tag='img', class_='wp-post-image', attr='src'),
+)
+
+
+@dataclass(slots=True)
+class ProductRecord:
+    """One scraped product, with 'N/A' for anything the page did not have.
+
+    Records have slots instead of a __dict__, and the category and currency,
+    shared by thousands of products, are interned so every record points at
+    one copy of each.
+    """
+    category: str = 'N/A'
+    title: str = 'N/A'
+    price: str = 'N/A'
+    sku: str = 'N/A'
+    description: str = 'N/A'
+    size: str = 'N/A'
+    image_url: str = None
+    url: str = None
+    currency: str = None
+    price_amount: str = None  # The price as Decimal text, e.g. '1234.50', filled in by validation
+
+    def __post_init__(self):
+        self.intern()
+
+    def intern(self):
+        """Intern the repetitive fields; call again after setting them."""
+        self.category = sys.intern(self.category)
+        if self.currency is not None:
+            self.currency = sys.intern(self.currency)
+        return self
+
+    def values(self):
+        """Return the text columns in spreadsheet order (Category .. Size)."""
+        return [self.category, self.title, self.price, self.sku, self.description, self.size]
+
+
+class _StopParsing(Exception):
+    pass
+
+
+class FieldCollector:
+    """Parser target that captures the first match of every field in one pass over the document.
+
+    It receives start/end/data events from either lxml or html.parser and stops
+    the parse as soon as every field has been found and closed.
+    """
+
+    def __init__(self, fields):
+        self.pending = list(fields)
+        self.found = {}
+        self.open = []  # (field name, depth) of elements whose text is being captured
+        self.depth = 0
+        self._text = []
+
+    def _flush(self):
+        # Text nodes can arrive in several chunks; join them so strip() sees the whole node
+        if self._text:
+            text = ''.join(self._text).strip()
+            self._text = []
+            if text:
+                for name, _ in self.open:
+                    self.found[name].append(text)
+
+    def start(self, tag, attrs):
+        self._flush()
+        self.depth += 1
+        for field in list(self.pending):
+            if field.within and not any(name == field.within and depth < self.depth for name, depth in self.open):
+                continue
+            if not field.matches(tag, attrs):
+                continue
+            self.pending.remove(field)
+            if field.attr:
+                self.found[field.name] = attrs.get(field.attr)
+            else:
+                self.found[field.name] = []
+                self.open.append((field.name, self.depth))
+
+    def end(self, tag):
+        self._flush()
+        while self.open and self.open[-1][1] == self.depth:
+            name, _ = self.open.pop()
+            # Only the first match of a field is searched, so fields nested in it can no longer match
+            self.pending = [field for field in self.pending if field.within != name]
+        self.depth -= 1
+        if not self.pending and not self.open:
+            raise _StopParsing
+
+    def data(self, text):
+        if self.open:
+            self._text.append(text)
+
+    def close(self):
+        self._flush()
+        return self.found
+
+
+class _StdlibDriver(HTMLParser):
+    """Feed html.parser events into a FieldCollector, repairing unclosed tags on the way."""
+
+    def __init__(self, collector):
+        super().__init__(convert_charrefs=True)
+        self.collector = collector
+        self.stack = []
+
+    def handle_starttag(self, tag, attrs):
+        self.collector.start(tag, {name: value or '' for name, value in attrs})
+        if tag in VOID_TAGS:
+            self.collector.end(tag)
+        else:
+            self.stack.append(tag)
+
+    def handle_endtag(self, tag):
+        if tag in VOID_TAGS or tag not in self.stack:
+            return
+        while self.stack:
+            open_tag = self.stack.pop()
+            self.collector.end(open_tag)
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        self.collector.data(data)
+
+
+def collect_fields(html, fields=PRODUCT_FIELDS, backend=None):
+    """Run every field selector over the HTML in a single pass and return the raw matches."""
+    backend = backend or ('lxml' if etree is not None else 'html.parser')
+    collector = FieldCollector(fields)
+    try:
+        if backend == 'lxml':
+            parser = etree.HTMLParser(target=collector)
+            parser.feed(html)
+            parser.close()
+        else:
+            driver = _StdlibDriver(collector)
+            driver.feed(html)
+            driver.close()
+    except _StopParsing:
+        pass
+    return collector.close()
+
+
+def _text(found, name):
+    """Return the captured text of a field, or None when the page did not have it."""
+    pieces = found.get(name)
+    return None if pieces is None else ''.join(pieces)
+
+
+def extract_product(html, url=None, fields=PRODUCT_FIELDS, backend=None):
+    """Extract a ProductRecord from a product page in a single parse."""
+    found = collect_fields(html, fields, backend)
+    record = ProductRecord(url=url, image_url=found.get('image'))
+
+    for name in ('category', 'title', 'description', 'size'):
+        text = _text(found, name)
+        if text is not None:
+            setattr(record, name, text)
+
+    if 'price' in found:
+        currency = _text(found, 'currency')
+        amount = _text(found, 'amount')
+        record.price = f"{'N/A' if currency is None else currency} {'N/A' if amount is None else amount}"
+        record.currency = currency
+
+    if 'sku_wrapper' in found and 'sku' in found:
+        record.sku = f"{_text(found, 'sku_wrapper')} {_text(found, 'sku')}"
+
+    return record.intern()
@@ -0,0 +1,174 @@
+from dataclasses import dataclass, field
+from functools import partial
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from browser_pool import BrowserPool, start_chrome
+from metrics import log, metrics
+from resilience import RETRYABLE_STATUSES, HostBreakers, RetryingFetcher, RetryPolicy
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+# Class names that only appear once WooCommerce has rendered the content we scrape
+CATEGORY_MARKER = 'ekit_badge_left'
+LISTING_MARKER = 'products columns-4'
+PRODUCT_MARKER = 'product_title entry-title'
+
+
+class MarkersMissing(LookupError):
+    """A page loaded fine but never showed the markup we scrape, in HTTP or in the browser."""
+
+
+@dataclass
+class FetchResult:
+    """A fetched page and where it came from."""
+    url: str
+    status: int
+    text: str
+    headers: dict = field(default_factory=dict)
+    engine: str = ''
+
+
+def make_session(pool_size=10):
+    """Create a keep-alive session that reuses connections across requests."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers['User-Agent'] = USER_AGENT
+    return session
+
+
+def has_markers(text, markers):
+    """Check that every marker class string is present in the raw HTML."""
+    return all(marker in text for marker in markers)
+
+
+class HttpFetcher:
+    """Fetch pages with plain HTTP over a pooled requests.Session."""
+
+    name = 'http'
+
+    def __init__(self, session=None, timeout=RetryPolicy().timeout, connections=10):
+        self.session = session or make_session(connections)
+        self.timeout = timeout  # (connect, read) seconds
+
+    def fetch(self, url, markers=(), headers=None):
+        with metrics.timer('fetch.http'):
+            response = self.session.get(url, headers=headers, timeout=self.timeout)
+        metrics.count('pages')
+        metrics.count('bytes', len(response.content))
+        if response.status_code == 304:
+            metrics.count('not_modified')
+        response.raise_for_status()
+        # A copy that still matches 'ETag' when a server or proxy sends 'etag'
+        return FetchResult(response.url, response.status_code, response.text, CaseInsensitiveDict(response.headers),
+                           self.name)
+
+    def close(self):
+        self.session.close()
+
+
+class BrowserFetcher:
+    """Fetch pages through undetected Chrome drivers borrowed from a BrowserPool.
+
+    The pool only starts a browser on first use, so HTTP-only runs never launch Chrome.
+    """
+
+    name = 'browser'
+
+    def __init__(self, pool=None, timeout=10):
+        self.pool = pool or BrowserPool(size=1)
+        self.timeout = timeout
+
+    def fetch(self, url, markers=(), headers=None):
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support.ui import WebDriverWait
+        from selenium.webdriver.support import expected_conditions as EC
+
+        if markers:
+            locator = (By.CSS_SELECTOR, ', '.join('.' + '.'.join(marker.split()) for marker in markers))
+        else:
+            locator = (By.TAG_NAME, 'body')
+        with self.pool.checkout() as driver:
+            with metrics.timer('browser.get'):
+                driver.get(url)
+            with metrics.timer('browser.wait'):
+                WebDriverWait(driver, self.timeout).until(EC.presence_of_element_located(locator))
+            page_source = driver.page_source
+            metrics.count('pages')
+            metrics.count('bytes', len(page_source.encode('utf-8')))
+            return FetchResult(driver.current_url, 200, page_source, {}, self.name)
+
+    def close(self):
+        self.pool.close()
+
+
+class FallbackFetcher:
+    """Try plain HTTP first and only fall back to the browser when the markup is missing."""
+
+    name = 'auto'
+
+    def __init__(self, primary=None, fallback=None):
+        self.primary = primary or HttpFetcher()
+        self.fallback = fallback or BrowserFetcher()
+
+    def fetch(self, url, markers=(), headers=None):
+        loaded = False
+        try:
+            result = self.primary.fetch(url, markers, headers)
+            if result.status == 304 or has_markers(result.text, markers):
+                return result
+            loaded = True
+            log('fallback', f"Markers {markers} missing from {url}, retrying with {self.fallback.name}", url=url)
+        except requests.RequestException as e:
+            response = getattr(e, 'response', None)
+            if response is not None and response.status_code in RETRYABLE_STATUSES:
+                raise  # The browser would hit the same overloaded server; let the retry layer back off
+            if response is not None and 400 <= response.status_code < 500 and response.status_code != 403:
+                raise  # A missing or gone page stays missing in Chrome; only a 403 may be bot protection
+            log('fallback', f"HTTP fetch failed for {url}, retrying with {self.fallback.name}. Error: {e}",
+                url=url, error=str(e))
+        metrics.count('fallbacks')
+        try:
+            return self.fallback.fetch(url, markers, headers)
+        except Exception as e:
+            # The server answered and the browser still found no markers: the page lacks them, retrying won't help
+            if loaded and any(cls.__name__ == 'TimeoutException' for cls in type(e).__mro__):
+                raise MarkersMissing(f"Markers {markers} never appeared on {url}") from e
+            raise
+
+    def close(self):
+        self.primary.close()
+        self.fallback.close()
+
+
+def make_fetcher(engine='auto', browsers=1, policy=None, breakers=None, cache=None, lean=False, blocked_urls=(),
+                 connections=10):
+    """Create the fetcher for an engine name ('http', 'browser' or 'auto'), with retries and circuit breakers.
+
+    With a ResponseCache every page fetched is also written to it; the 'replay'
+    engine serves pages from the cache alone. `connections` sizes the HTTP
+    connection pool, e.g. to the crawl's concurrency. `lean` starts browsers that skip
+    images, fonts, media, stylesheets and trackers (see start_chrome).
+    """
+    from response_cache import CachingFetcher, ReplayFetcher, ResponseCache
+
+    policy = policy or RetryPolicy()
+    if engine == 'replay':
+        return ReplayFetcher(cache or ResponseCache())
+    driver_factory = partial(start_chrome, lean=True, blocked_urls=blocked_urls) if lean else start_chrome
+    if engine == 'http':
+        fetcher = HttpFetcher(timeout=policy.timeout, connections=connections)
+    elif engine == 'browser':
+        fetcher = BrowserFetcher(BrowserPool(size=browsers, driver_factory=driver_factory))
+    elif engine == 'auto':
+        fetcher = FallbackFetcher(HttpFetcher(timeout=policy.timeout, connections=connections),
+                                  BrowserFetcher(BrowserPool(size=browsers, driver_factory=driver_factory)))
+    else:
+        raise ValueError(f"Unknown fetch engine: {engine}")
+    if cache is not None:
+        fetcher = CachingFetcher(fetcher, cache)
+    return RetryingFetcher(fetcher, policy, breakers if breakers is not None else HostBreakers())
@@ -0,0 +1,271 @@
+"""Synthetic capraleo-style WooCommerce site served from a local HTTP server.
+
+Usage: python fixture_site.py [--port 8765] [--categories 3] [--products 40] ...
+
+Pages are generated on request from a SiteSpec: a homepage with category
+badges, paginated listing pages, product pages shaped like the real ones,
+JPEG product images and the Store API product/category endpoints. Latency and
+an error rate can be added to every request except the homepage.
+"""
+import argparse
+import html
+import json
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import parse_qs, urlsplit
+
+PRODUCT_PAGE = '''<!DOCTYPE html>
+<html lang="en-US"><head><meta charset="UTF-8"><title>{title} - Capraleo</title></head>
+<body class="product-template-default single single-product woocommerce">
+<div class="elementor-container elementor-column-gap-default"><nav><ul class="elementor-nav-menu">{menu}</ul></nav></div>
+<div class="product type-product">
+<span class="single-product-category">{category}</span>
+<h1 class="product_title entry-title">{title}</h1>
+<p class="price"><span class="woocommerce-Price-amount amount"><bdi><span class="woocommerce-Price-currencySymbol">&#36;</span>{price}</bdi></span></p>
+<div class="product_meta"><span class="sku_wrapper">SKU: <span class="sku">{sku}</span></span></div>
+<div class="woocommerce-Tabs-panel" id="tab-description"><h2>Description</h2><p>{description}</p><p>Autoclavable.</p></div>
+<table class="woocommerce-product-attributes shop_attributes"><tr><th>Size</th><td class="woocommerce-product-attributes-item__value"><p>{size}</p></td></tr></table>
+<img class="attachment-shop_single wp-post-image" src="{image}"/>
+</div></body></html>
+'''
+
+LISTING_PAGE = '''<!DOCTYPE html>
+<html><body class="archive tax-product_cat woocommerce">
+<div class="elementor-container"><h1>{category}</h1>
+<ul class="products columns-4">{items}</ul>
+<nav class="woocommerce-pagination">{next_link}</nav></div></body></html>
+'''
+
+HOME_PAGE = '''<!DOCTYPE html>
+<html><body class="home"><div class="elementor-container">{badges}</div></body></html>
+'''
+
+
+@dataclass
+class SiteSpec:
+    """Shape of the synthetic catalog and how badly its server behaves."""
+    categories: int = 3
+    products: int = 40  # per category
+    per_page: int = 16
+    image_size: tuple = (800, 800)
+    distinct_images: int = 8
+    page_bytes: int = 40000  # product pages are padded with menu markup to about this size
+    latency: float = 0.0  # seconds added to each request
+    error_rate: float = 0.0  # share of requests answered with 503
+    seed: int = 0
+
+
+class FixtureSite:
+    """Generate the pages of a SiteSpec; `base_url` must be set before pages are rendered."""
+
+    def __init__(self, spec=None, base_url='http://127.0.0.1:8765/'):
+        self.spec = spec or SiteSpec()
+        self.base_url = base_url
+        self.random = random.Random(self.spec.seed)
+        self._random_lock = threading.Lock()
+        self._images = {}
+        self._images_lock = threading.Lock()
+
+    def category_slug(self, index):
+        return f'category-{index}'
+
+    def category_url(self, index):
+        return f'{self.base_url}product-category/{self.category_slug(index)}/'
+
+    def product_slug(self, category, index):
+        return f'instrument-{category}-{index}'
+
+    def product_url(self, category, index):
+        return f'{self.base_url}product/{self.product_slug(category, index)}/'
+
+    def image_url(self, category, index):
+        return f'{self.base_url}img/{self.product_slug(category, index)}.jpg'
+
+    def product_fields(self, category, index):
+        number = category * self.spec.products + index
+        return {
+            'category': f'Category {category}',
+            'title': f'Surgical Instrument {category}-{index}',
+            'price': f'{10 + number % 90}.{number % 100:02d}',
+            'sku': f'CL-{category:02d}-{index:04d}',
+            'description': f'Stainless steel instrument number {index} of category {category}.',
+            'size': f'{12 + index % 10} cm',
+            'image': self.image_url(category, index),
+        }
+
+    def home_page(self):
+        badges = ''.join(f'<a class="ekit_badge_left" href="{self.category_url(i)}">Category {i}</a>'
+                         for i in range(self.spec.categories))
+        return HOME_PAGE.format(badges=badges)
+
+    def listing_page(self, category, page):
+        start = (page - 1) * self.spec.per_page
+        indexes = range(start, min(start + self.spec.per_page, self.spec.products))
+        if not indexes:
+            return None
+        items = ''.join(f'<li class="product"><a href="{self.product_url(category, i)}">'
+                        f'<img src="{self.image_url(category, i)}"/></a>'
+                        f'<a href="{self.product_url(category, i)}">Instrument {i}</a></li>' for i in indexes)
+        next_link = ''
+        if indexes.stop < self.spec.products:
+            next_link = f'<a class="next page-numbers" href="{self.category_url(category)}page/{page + 1}/">Next</a>'
+        return LISTING_PAGE.format(category=f'Category {category}', items=items, next_link=next_link)
+
+    def product_page(self, category, index):
+        fields = {name: html.escape(value) for name, value in self.product_fields(category, index).items()}
+        page = PRODUCT_PAGE.format(menu='', **fields)
+        menu, item = [], 0
+        while len(page) + sum(map(len, menu)) < self.spec.page_bytes:
+            menu.append(f'<li class="menu-item"><a href="{self.base_url}product-category/menu-{item}/" '
+                        f'class="elementor-item">Menu entry {item}</a></li>')
+            item += 1
+        return PRODUCT_PAGE.format(menu=''.join(menu), **fields)
+
+    def image(self, category, index):
+        """JPEG bytes for a product image; products share `distinct_images` different pictures."""
+        variant = (category * self.spec.products + index) % self.spec.distinct_images
+        with self._images_lock:
+            if variant not in self._images:
+                from PIL import Image
+
+                shade = 40 + variant * 200 // self.spec.distinct_images
+                buffer = BytesIO()
+                Image.new('RGB', self.spec.image_size, (shade, 255 - shade, 128)).save(buffer, 'JPEG', quality=85)
+                self._images[variant] = buffer.getvalue()
+            return self._images[variant]
+
+    def store_item(self, category, index):
+        fields = self.product_fields(category, index)
+        return {
+            'id': category * self.spec.products + index + 1,
+            'name': fields['title'],
+            'slug': self.product_slug(category, index),
+            'permalink': self.product_url(category, index),
+            'sku': fields['sku'],
+            'description': f"<p>{html.escape(fields['description'])}</p><p>Autoclavable.</p>",
+            'prices': {'price': fields['price'].replace('.', ''), 'currency_code': 'USD', 'currency_symbol': '$',
+                       'currency_minor_unit': 2, 'currency_decimal_separator': '.',
+                       'currency_thousand_separator': ',', 'currency_prefix': '$', 'currency_suffix': ''},
+            'categories': [{'id': category + 1, 'name': fields['category'], 'slug': self.category_slug(category)}],
+            'attributes': [{'name': 'Size', 'terms': [{'name': fields['size']}]}],
+            'images': [{'src': fields['image']}],
+        }
+
+    def store_api(self, resource, query):
+        """Return (body, headers) for a page of the Store API products or categories collection."""
+        if resource == 'categories':
+            items = [{'id': i + 1, 'name': f'Category {i}', 'slug': self.category_slug(i), 'parent': 0,
+                      'permalink': self.category_url(i)} for i in range(self.spec.categories)]
+        else:
+            items = [(c, i) for c in range(self.spec.categories) for i in range(self.spec.products)]
+        per_page = int(query.get('per_page', ['10'])[0])
+        page = int(query.get('page', ['1'])[0])
+        total_pages = max(1, -(-len(items) // per_page))
+        chunk = items[(page - 1) * per_page:page * per_page]
+        if resource != 'categories':
+            chunk = [self.store_item(c, i) for c, i in chunk]
+        return json.dumps(chunk), {'X-WP-Total': str(len(items)), 'X-WP-TotalPages': str(total_pages)}
+
+    def should_fail(self):
+        if not self.spec.error_rate:
+            return False
+        with self._random_lock:
+            return self.random.random() < self.spec.error_rate
+
+    def respond(self, path, query):
+        """Return (status, content type, body bytes, extra headers) for a request path."""
+        path = re.sub('/+', '/', path)
+        if path != '/':
+            if self.spec.latency:
+                time.sleep(self.spec.latency)
+            if self.should_fail():
+                return 503, 'text/plain', b'Service Unavailable', {'Retry-After': '1'}
+
+        if path == '/':
+            return 200, 'text/html; charset=utf-8', self.home_page().encode('utf-8'), {}
+        match = re.fullmatch(r'/wp-json/wc/store(?:/v1)?/products(?:/(categories))?/?', path)
+        if match:
+            body, headers = self.store_api(match.group(1) or 'products', query)
+            return 200, 'application/json; charset=utf-8', body.encode('utf-8'), headers
+        match = re.fullmatch(r'/product-category/category-(\d+)/(?:page/(\d+)/)?', path)
+        if match and int(match.group(1)) < self.spec.categories:
+            page = self.listing_page(int(match.group(1)), int(match.group(2) or 1))
+            if page is not None:
+                return 200, 'text/html; charset=utf-8', page.encode('utf-8'), {}
+        match = re.fullmatch(r'/product/instrument-(\d+)-(\d+)/', path)
+        if match and int(match.group(1)) < self.spec.categories and int(match.group(2)) < self.spec.products:
+            page = self.product_page(int(match.group(1)), int(match.group(2)))
+            return 200, 'text/html; charset=utf-8', page.encode('utf-8'), {}
+        match = re.fullmatch(r'/img/instrument-(\d+)-(\d+)\.jpg', path)
+        if match and int(match.group(1)) < self.spec.categories and int(match.group(2)) < self.spec.products:
+            return 200, 'image/jpeg', self.image(int(match.group(1)), int(match.group(2))), {}
+        return 404, 'text/html; charset=utf-8', b'<html><body>Not found</body></html>', {}
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive, like the real site
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        status, content_type, body, headers = self.server.site.respond(url.path, parse_qs(url.query))
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # One line per request would drown the crawler's own output
+
+
+def start_server(spec=None, host='127.0.0.1', port=0):
+    """Serve a FixtureSite on a background thread; return (server, base_url). Port 0 picks a free port."""
+    server = ThreadingHTTPServer((host, port), FixtureHandler)
+    server.daemon_threads = True
+    base_url = f'http://{host}:{server.server_address[1]}/'
+    server.site = FixtureSite(spec, base_url)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, base_url
+
+
+def add_spec_arguments(parser):
+    """Add the SiteSpec options to an argparse parser."""
+    parser.add_argument('--categories', type=int, default=SiteSpec.categories)
+    parser.add_argument('--products', type=int, default=SiteSpec.products, help='products per category')
+    parser.add_argument('--per-page', type=int, default=SiteSpec.per_page, help='products per listing page')
+    parser.add_argument('--image-size', type=int, default=SiteSpec.image_size[0], help='image width and height')
+    parser.add_argument('--page-bytes', type=int, default=SiteSpec.page_bytes, help='product page size')
+    parser.add_argument('--latency', type=float, default=SiteSpec.latency, help='seconds added per request')
+    parser.add_argument('--error-rate', type=float, default=SiteSpec.error_rate, help='share of 503 responses')
+    parser.add_argument('--seed', type=int, default=SiteSpec.seed)
+
+
+def spec_from_arguments(args):
+    return SiteSpec(categories=args.categories, products=args.products, per_page=args.per_page,
+                    image_size=(args.image_size, args.image_size), page_bytes=args.page_bytes,
+                    latency=args.latency, error_rate=args.error_rate, seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8765)
+    add_spec_arguments(parser)
+    args = parser.parse_args()
+
+    server, base_url = start_server(spec_from_arguments(args), port=args.port)
+    print(f"Serving {args.categories} x {args.products} products at {base_url} (Ctrl+C to stop)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+import json
+import sqlite3
+import threading
+import time
+from dataclasses import asdict
+
+from extractor import ProductRecord
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS sub_categories (
+    name TEXT PRIMARY KEY,
+    link TEXT NOT NULL,
+    listed_pages INTEGER NOT NULL DEFAULT 0,
+    listed INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS frontier (
+    url TEXT NOT NULL,
+    sub_category TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    record TEXT,
+    updated_at REAL,
+    PRIMARY KEY (sub_category, url)
+);
+'''
+
+# Product URL states; in_flight and failed URLs are fetched again when a crawl resumes
+PENDING, IN_FLIGHT, DONE, FAILED = 'pending', 'in_flight', 'done', 'failed'
+
+
+class Frontier:
+    """Journal of one crawl in SQLite, so a crashed or killed run resumes where it stopped.
+
+    It records the subcategories to crawl, how many listing pages of each were
+    walked, every product URL found with its state (pending, in_flight, done,
+    failed) and the record extracted from each done product. Writes are queued
+    and committed in batches of `batch_size`, or after `flush_interval`
+    seconds, in one transaction, so the journal stays off the hot path; a crash
+    loses at most one batch, whose products are simply fetched again.
+
+    A run that finishes marks the journal finished, and the next run starts a
+    new one.
+    """
+
+    def __init__(self, path='crawl_frontier.db', batch_size=50, flush_interval=2.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+        self._lock = threading.RLock()
+        self._pending_writes = []
+        self._last_flush = time.monotonic()
+        self._flush_callbacks = []
+
+    def on_flush(self, callback):
+        """Call `callback()` after every committed batch, e.g. to log what is now safely journaled."""
+        with self._lock:
+            self._flush_callbacks.append(callback)
+
+    def start(self):
+        """Begin a crawl: resume the journal of an unfinished run, or clear a finished one.
+
+        Returns True when resuming.
+        """
+        with self._lock, self.connection:
+            row = self.connection.execute("SELECT value FROM meta WHERE key = 'state'").fetchone()
+            resuming = row is not None and row[0] == 'running' and self.sub_categories()
+            if not resuming:
+                self.connection.execute('DELETE FROM frontier')
+                self.connection.execute('DELETE FROM sub_categories')
+            self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('state', 'running')")
+        return bool(resuming)
+
+    def finish(self):
+        """Mark the crawl complete, so the next run starts from scratch."""
+        self.flush()
+        with self._lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('state', 'finished')")
+
+    def _write(self, sql, params):
+        """Queue a write and commit the queue once it is large or old enough."""
+        with self._lock:
+            self._pending_writes.append((sql, params))
+            if (len(self._pending_writes) >= self.batch_size
+                    or time.monotonic() - self._last_flush >= self.flush_interval):
+                self.flush()
+
+    def flush(self):
+        """Commit every queued write in one transaction, then run the on_flush callbacks."""
+        with self._lock:
+            if self._pending_writes:
+                with self.connection:
+                    for sql, params in self._pending_writes:
+                        self.connection.execute(sql, params)
+                self._pending_writes = []
+            self._last_flush = time.monotonic()
+            for callback in self._flush_callbacks:
+                callback()
+
+    def add_sub_categories(self, sub_category_links):
+        """Record the (link, name) subcategories this crawl will cover, in order."""
+        with self._lock, self.connection:
+            self.connection.executemany('INSERT OR IGNORE INTO sub_categories (name, link) VALUES (?, ?)',
+                                        [(name, link) for link, name in sub_category_links])
+
+    def sub_categories(self):
+        """Return the (link, name) subcategories of the crawl in the order they were added."""
+        with self._lock:
+            return self.connection.execute('SELECT link, name FROM sub_categories ORDER BY rowid').fetchall()
+
+    def listing_progress(self, sub_category):
+        """Return (listing pages walked so far, whether the listing is complete)."""
+        self.flush()
+        with self._lock:
+            row = self.connection.execute('SELECT listed_pages, listed FROM sub_categories WHERE name = ?',
+                                          (sub_category,)).fetchone()
+        return (row[0], bool(row[1])) if row else (0, False)
+
+    def add_listing_page(self, sub_category, page_number, product_links, last=False):
+        """Record the product links found on one listing page."""
+        for link in product_links:
+            self._write('INSERT OR IGNORE INTO frontier (url, sub_category, updated_at) VALUES (?, ?, ?)',
+                        (link, sub_category, time.time()))
+        self._write('UPDATE sub_categories SET listed_pages = MAX(listed_pages, ?), listed = MAX(listed, ?) '
+                    'WHERE name = ?', (page_number, int(last), sub_category))
+
+    def finish_listing(self, sub_category):
+        """Record that every listing page of a subcategory was walked."""
+        self._write('UPDATE sub_categories SET listed = 1 WHERE name = ?', (sub_category,))
+
+    def product_links(self, sub_category):
+        """Return every product URL listed for a subcategory, in listing order."""
+        self.flush()
+        with self._lock:
+            rows = self.connection.execute('SELECT url FROM frontier WHERE sub_category = ? ORDER BY rowid',
+                                           (sub_category,)).fetchall()
+        return [url for (url,) in rows]
+
+    def done_links(self, sub_category):
+        """Yield the product URLs of a subcategory that are already scraped, without loading them all at once."""
+        self.flush()
+        with self._lock:
+            cursor = self.connection.execute('SELECT url FROM frontier WHERE sub_category = ? AND status = ?',
+                                             (sub_category, DONE))
+            for (url,) in cursor:
+                yield url
+
+    def _set_status(self, sub_category, url, status, record=None):
+        self._write('INSERT INTO frontier (url, sub_category, status, record, updated_at) VALUES (?, ?, ?, ?, ?) '
+                    'ON CONFLICT(sub_category, url) DO UPDATE SET status = excluded.status, '
+                    'record = COALESCE(excluded.record, frontier.record), updated_at = excluded.updated_at',
+                    (url, sub_category, status, record, time.time()))
+
+    def mark_in_flight(self, sub_category, url):
+        self._set_status(sub_category, url, IN_FLIGHT)
+
+    def mark_done(self, sub_category, record):
+        self._set_status(sub_category, record.url, DONE, json.dumps(asdict(record)))
+
+    def mark_failed(self, sub_category, url):
+        self._set_status(sub_category, url, FAILED)
+
+    def records(self, sub_category):
+        """Yield the records of a subcategory's done products in listing order."""
+        self.flush()
+        with self._lock:
+            rows = self.connection.execute(
+                'SELECT record FROM frontier WHERE sub_category = ? AND status = ? AND record IS NOT NULL '
+                'ORDER BY rowid', (sub_category, DONE)).fetchall()
+        for (data,) in rows:
+            yield ProductRecord(**json.loads(data))
+
+    def close(self):
+        self.flush()
+        self.connection.close()
@@ -0,0 +1,303 @@
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import urlsplit
+
+from PIL import Image
+
+from fetcher import make_session
+from metrics import log, metrics
+from resilience import RetryPolicy, with_retries
+
+
+# Two images are treated as the same photo when their perceptual hashes differ in at most PHASH_DISTANCE
+# bits and no channel of their mean colours differs by more than COLOUR_DISTANCE
+PHASH_DISTANCE = 3
+COLOUR_DISTANCE = 12
+
+
+def size_name(size):
+    return f'{size[0]}x{size[1]}'
+
+
+def parse_sizes(text):
+    """Parse thumbnail sizes such as '100x100,300x300' into [(100, 100), (300, 300)]."""
+    return [tuple(int(value) for value in part.strip().split('x')) for part in text.split(',') if part.strip()]
+
+
+def dhash(img, size=8):
+    """Difference hash: one bit per pair of horizontally adjacent pixels of a (size+1) x size grayscale copy.
+
+    Re-encoded, resized or recompressed copies of a photo get the same or a
+    nearly the same hash.
+    """
+    pixels = img.convert('L').resize((size + 1, size), Image.BILINEAR).tobytes()
+    bits = 0
+    for row in range(size):
+        offset = row * (size + 1)
+        for column in range(size):
+            bits = bits << 1 | (pixels[offset + column] > pixels[offset + column + 1])
+    return bits
+
+
+def signature(img):
+    """(dHash, mean RGB colour) of an image.
+
+    dHash only sees brightness gradients, so the same shot of a product in
+    another colour, or two flat swatches, hash alike; the mean colour tells
+    them apart.
+    """
+    return dhash(img), tuple(img.convert('RGB').resize((1, 1), Image.BOX).getpixel((0, 0)))
+
+
+def make_thumbnails(data, sizes, directory, extension='.png', find_duplicate=None):
+    """Decode image bytes once, hash them perceptually and save a thumbnail per size.
+
+    Returns (signature, {size name: thumbnail path}); the files are named
+    `<dHash><mean colour>_<W>x<H><extension>` in `directory`. When find_duplicate(signature)
+    returns the thumbnails of a near-identical image already stored, those are
+    returned and nothing is written.
+    """
+    img = Image.open(BytesIO(data))
+    img.draft(img.mode, (max(width for width, _ in sizes), max(height for _, height in sizes)))  # JPEGs decode straight at 1/2, 1/4 or 1/8 scale
+    image_signature = signature(img)
+    existing = find_duplicate(image_signature) if find_duplicate is not None else None
+    if existing:
+        return image_signature, existing
+
+    phash, colour = image_signature
+    name = f'{phash:016x}' + ''.join(f'{channel:02x}' for channel in colour)
+    image_format = Image.registered_extensions().get(extension.lower(), 'PNG')
+    thumbnails = {}
+    # Each size is scaled from the decoded image, whose draft covers the widest and the tallest size
+    for size in sizes:
+        thumbnail = img.copy()
+        thumbnail.thumbnail(size)
+        path = os.path.join(directory, f'{name}_{size_name(size)}{extension}')
+        # Save under a temporary name so a crash never leaves a half-written thumbnail in the cache;
+        # variants sharing a photo can be thumbnailed at the same moment, so each writer gets its own
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        thumbnail.save(tmp_path, format=image_format)
+        os.replace(tmp_path, path)
+        thumbnails[size_name(size)] = path
+    return image_signature, thumbnails
+
+
+def write_json(path, data):
+    """Write a small JSON file atomically."""
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        json.dump(data, file)
+    os.replace(tmp_path, path)
+
+
+class ImageIndex:
+    """The images stored in the cache, found by content hash or by perceptual hash.
+
+    Kept as a JSON-lines file next to the thumbnails. Each dHash is also filed
+    under its four 16-bit bands: two hashes at most PHASH_DISTANCE (< 4) bits
+    apart agree exactly on at least one band, so a lookup only compares
+    against the images sharing a band with it.
+    """
+
+    def __init__(self, path, max_distance=PHASH_DISTANCE, max_colour_distance=COLOUR_DISTANCE):
+        self.path = path
+        self.max_distance = max_distance
+        self.max_colour_distance = max_colour_distance
+        self.by_content = {}  # sha256 of the downloaded bytes -> thumbnails
+        self.by_signature = {}  # (dHash, mean colour) -> thumbnails
+        self.bands = [{} for _ in range(4)]
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # A line torn by a crash
+                    self._index(entry['content_hash'], (int(entry['phash'], 16), tuple(entry['colour'])),
+                                entry['thumbnails'])
+
+    def _index(self, content_hash, image_signature, thumbnails):
+        # Sizes added by a later run join the sizes already stored for the image
+        self.by_content[content_hash] = {**self.by_content.get(content_hash, {}), **thumbnails}
+        if image_signature not in self.by_signature:
+            for band, buckets in enumerate(self.bands):
+                buckets.setdefault(image_signature[0] >> (16 * band) & 0xFFFF, []).append(image_signature)
+        self.by_signature[image_signature] = {**self.by_signature.get(image_signature, {}), **thumbnails}
+        return self.by_content[content_hash]
+
+    def find_content(self, content_hash):
+        with self._lock:
+            return self.by_content.get(content_hash)
+
+    def find_similar(self, image_signature):
+        """Return the thumbnails of a stored image that looks the same as one with this signature, or None."""
+        phash, colour = image_signature
+        with self._lock:
+            for band, buckets in enumerate(self.bands):
+                for candidate in buckets.get(phash >> (16 * band) & 0xFFFF, ()):
+                    if ((candidate[0] ^ phash).bit_count() <= self.max_distance and
+                            max(abs(a - b) for a, b in zip(candidate[1], colour)) <= self.max_colour_distance):
+                        return self.by_signature[candidate]
+        return None
+
+    def add(self, content_hash, image_signature, thumbnails):
+        """Record an image's thumbnails and return every size stored for its content."""
+        with self._lock:
+            thumbnails = self._index(content_hash, image_signature, thumbnails)
+            with open(self.path, 'a', encoding='utf-8') as file:
+                file.write(json.dumps({'content_hash': content_hash, 'phash': f'{image_signature[0]:016x}',
+                                       'colour': image_signature[1], 'thumbnails': thumbnails}) + '\n')
+        return thumbnails
+
+
+class ImageStage:
+    """Download and thumbnail product images on a thread pool, behind a deduplicating cache.
+
+    Each image is decoded once, perceptually hashed and thumbnailed at every
+    size in `sizes` (the first is the one submit() returns, e.g. for Excel).
+    Thumbnails are named by the perceptual hash, and an image whose bytes or
+    hash match one already stored (product variants usually share one photo)
+    reuses its thumbnails, so every sink and workbook refers to a single copy.
+    A small JSON entry per URL keeps the ETag/Last-Modified so later runs send
+    conditional requests and reuse the cached thumbnail on a 304. Each URL is
+    only fetched once per run, however many products or subcategories share it.
+    """
+
+    def __init__(self, cache_dir='images/cache', max_size=(100, 100), workers=4, session=None, policy=None,
+                 breakers=None, dead_letters=None, cpu=None, offline=False, sizes=None, rate_limits=None):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.sizes = [tuple(size) for size in sizes] if sizes else [max_size]
+        self.policy = policy or RetryPolicy()
+        self.breakers = breakers  # Shared with the page fetcher, so an overloaded host pauses both
+        self.rate_limits = rate_limits  # HostRateLimits shared with the page fetches, if any
+        self.dead_letters = dead_letters
+        self.cpu = cpu  # CpuPool that decodes and resizes in worker processes, if any
+        self.offline = offline  # Only use cached thumbnails, e.g. when replaying a crawl
+        self.session = session or make_session(workers)
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix='images')
+        self._futures = {}
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.index = ImageIndex(os.path.join(cache_dir, 'index.jsonl'))
+
+    def submit(self, image_url):
+        """Start fetching an image and return a Future for its thumbnail path ('N/A' on failure)."""
+        if not image_url:
+            future = Future()
+            future.set_result('N/A')
+            return future
+        with self._lock:
+            if image_url not in self._futures:
+                self._futures[image_url] = self.executor.submit(self.fetch_thumbnail, image_url)
+            return self._futures[image_url]
+
+    def _entry_path(self, image_url):
+        return os.path.join(self.cache_dir, hashlib.sha256(image_url.encode('utf-8')).hexdigest()[:32] + '.json')
+
+    def fetch_thumbnail(self, image_url):
+        """Fetch one image (conditionally when cached) and return the path of its thumbnail."""
+        try:
+            entry_path = self._entry_path(image_url)
+            entry = {}
+            if os.path.exists(entry_path):
+                with open(entry_path, encoding='utf-8') as file:
+                    entry = json.load(file)
+            primary = size_name(self.sizes[0])
+            cached = self._entry_thumbnails(entry)
+            usable = self._complete(cached)  # Changing the sizes refetches each image once
+
+            if self.offline:
+                if usable:
+                    metrics.count('image_cache_hits')
+                    return cached[primary]
+                return 'N/A'
+
+            headers = {}
+            if usable:
+                if entry.get('etag'):
+                    headers['If-None-Match'] = entry['etag']
+                if entry.get('last_modified'):
+                    headers['If-Modified-Since'] = entry['last_modified']
+
+            def download():
+                if self.rate_limits is not None:
+                    self.rate_limits.get(image_url).wait()
+                response = self.session.get(image_url, headers=headers, timeout=self.policy.timeout)
+                response.raise_for_status()
+                return response
+
+            with metrics.timer('image.download'):
+                response = with_retries(image_url, download, self.policy, self.breakers)
+            if response.status_code == 304:
+                metrics.count('image_cache_hits')
+                return cached[primary]
+            metrics.count('image_bytes', len(response.content))
+
+            content_hash = hashlib.sha256(response.content).hexdigest()
+            thumbnails = self.index.find_content(content_hash)
+            if self._complete(thumbnails):
+                metrics.count('image_cache_hits')
+            else:
+                thumbnails = self.store_thumbnails(image_url, response.content, content_hash)
+
+            write_json(entry_path, {
+                'url': image_url,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'content_hash': content_hash,
+                'thumbnail': thumbnails[primary],
+                'thumbnails': thumbnails,
+            })
+            return thumbnails[primary]
+        except Exception as e:
+            metrics.count('image_errors')
+            if self.dead_letters is not None:
+                self.dead_letters.add('image', image_url, e)
+            log('image_error', f"Failed to download or resize image from {image_url}. Error: {e}",
+                url=image_url, error=str(e))
+            return 'N/A'
+
+    def store_thumbnails(self, image_url, data, content_hash):
+        """Thumbnail new image bytes at every size, or reuse the thumbnails of a near-identical image."""
+        extension = os.path.splitext(urlsplit(image_url).path)[1].lower() or '.png'
+
+        def find_duplicate(image_signature):
+            thumbnails = self.index.find_similar(image_signature)
+            return thumbnails if self._complete(thumbnails) else None
+
+        if self.cpu is not None:
+            # The worker process cannot see the index, so it always writes; its files are dropped if they duplicate
+            future = self.cpu.thumbnails(data, self.sizes, self.cache_dir, extension)
+            image_signature, thumbnails = future.result()  # Timed by the pool
+        else:
+            with metrics.timer('image.thumbnail'):
+                image_signature, thumbnails = make_thumbnails(data, self.sizes, self.cache_dir, extension,
+                                                              find_duplicate)
+        duplicate = find_duplicate(image_signature)
+        if duplicate:
+            for path in set(thumbnails.values()) - set(duplicate.values()):
+                os.remove(path)
+            metrics.count('image_duplicates')
+            thumbnails = duplicate
+        return self.index.add(content_hash, image_signature, thumbnails)
+
+    def _complete(self, thumbnails):
+        """True when stored thumbnails cover every configured size and are still on disk."""
+        return bool(thumbnails) and all(size_name(size) in thumbnails and os.path.exists(thumbnails[size_name(size)])
+                                        for size in self.sizes)
+
+    def _entry_thumbnails(self, entry):
+        if not entry:
+            return {}
+        # Entries written before thumbnails came in several sizes hold a single max_size one
+        return entry.get('thumbnails') or {size_name(self.max_size): entry['thumbnail']}
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.session.close()
@@ -2,8 +2,8 @@ import undetected_chromedriver as uc
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from bs4 import BeautifulSoup
 import requests
+from extractor import extract_product
 import os
 import time
 import csv
@@ -45,36 +45,12 @@ def download_image(image_url, image_name):
 
 def scrape_product_data(driver, writer):
     try:
-        soup = BeautifulSoup(driver.page_source, 'html.parser')
-
-        # Extract data using BeautifulSoup
-        category = soup.find(class_='single-product-category')
-        title = soup.find(class_='product_title entry-title')
-        price_element = soup.find(class_='woocommerce-Price-amount')
-        sku_wrapper = soup.find(class_='sku_wrapper')
-        sku = soup.find(class_='sku')
-        description_div = soup.find('div', id='tab-description')
-        size = soup.find(class_='woocommerce-product-attributes-item__value')
-        image_tag = soup.find('img', class_='wp-post-image')  # Extract image with this class
-
-        # Extract text with default values if elements are not found
-        category_text = category.get_text(strip=True) if category else 'N/A'
-        title_text = title.get_text(strip=True) if title else 'N/A'
-        
-        if price_element:
-            price_currency = price_element.find(class_='woocommerce-Price-currencySymbol').get_text(strip=True) if price_element.find(class_='woocommerce-Price-currencySymbol') else 'N/A'
-            price_value = price_element.find('bdi').get_text(strip=True) if price_element.find('bdi') else 'N/A'
-            price_text = f"{price_currency} {price_value}"
-        else:
-            price_text = 'N/A'
-        
-        sku_combined = f"{sku_wrapper.get_text(strip=True)} {sku.get_text(strip=True)}" if sku_wrapper and sku else 'N/A'
-        description_text = description_div.find('p').get_text(strip=True) if description_div and description_div.find('p') else 'N/A'
-        size_text = size.get_text(strip=True) if size else 'N/A'
-        
+        record = extract_product(driver.page_source, driver.current_url)
+        category_text, title_text, price_text, sku_combined, description_text, size_text = record.values()
+
         # Extract image URL and download the image
-        if image_tag:
-            image_url = image_tag['src']
+        if record.image_url:
+            image_url = record.image_url
             image_name = image_url.split('/')[-1]
             image_path = download_image(image_url, image_name)
         else:
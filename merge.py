@@ -0,0 +1,203 @@
+"""Merge per-subcategory outputs into one catalog workbook.
+
+Usage: python merge.py [outputs ...] [--output capraleo_catalog.xlsx] [--thumbnail-size 300x300]
+
+Without arguments every *_product_data file in the current directory is used
+(JSONL, Parquet or CSV when present, otherwise the .xlsx); the outputs of a
+dead-letter retry (*_retry-<time>_product_data) join their subcategory.
+Products are deduplicated by SKU, or by URL when they have none. The workbook
+has a master sheet with one row per product and the categories it belongs to,
+one sheet per category, and a category map sheet.
+"""
+import argparse
+import glob
+import hashlib
+import os
+import re
+from dataclasses import dataclass, field
+
+import xlsxwriter
+
+from images import ImageStage, parse_sizes
+from metrics import log
+from sinks import HEADERS, read_rows, record_of
+
+OUTPUT_SUFFIX = '_product_data'
+# Outputs of a dead-letter retry, e.g. forceps_retry-20260101-120000_product_data.jsonl
+RETRY_SUFFIX = re.compile(r'_retry-\d{8}-\d{6}$')
+# When one subcategory has several outputs, read the first of these
+SOURCE_PREFERENCE = ('.jsonl', '.parquet', '.csv', '.xlsx')
+INVALID_SHEET_CHARACTERS = '[]:*?/\\'
+
+
+@dataclass
+class MergedProduct:
+    """One unique product and every category it was listed under."""
+    record: object
+    categories: list = field(default_factory=list)
+    image: object = None  # Thumbnail path, or a Future for one
+
+
+def product_key(record):
+    """Identify a product by its SKU ("SKU:X X" keeps the bare SKU last), else by its URL or title."""
+    if record.sku and record.sku != 'N/A':
+        return 'sku:' + record.sku.split()[-1]
+    if record.url:
+        return 'url:' + record.url
+    return 'title:' + record.title
+
+
+def category_of(path):
+    """The subcategory name of an output file, e.g. forceps_product_data.jsonl -> forceps."""
+    return RETRY_SUFFIX.sub('', os.path.basename(os.path.splitext(path)[0]).removesuffix(OUTPUT_SUFFIX))
+
+
+def find_sources(directory='.'):
+    """Pick one file per subcategory output (and per retry of it), preferring the formats that keep image URLs."""
+    sources = {}
+    for path in sorted(glob.glob(os.path.join(directory, f'*{OUTPUT_SUFFIX}.*'))):
+        base, extension = os.path.splitext(path)
+        # Only <name>_product_data.<ext>; a sink's .checkpoint.jsonl and .tmp files are not outputs
+        if not base.endswith(OUTPUT_SUFFIX) or extension.lower() not in SOURCE_PREFERENCE:
+            continue
+        current = sources.get(base)
+        if current is None or SOURCE_PREFERENCE.index(extension.lower()) < SOURCE_PREFERENCE.index(os.path.splitext(current)[1]):
+            sources[base] = path
+    return list(sources.values())
+
+
+def read_xlsx(path, cache_dir):
+    """Yield (record, thumbnail path) for the rows of a crawler workbook, saving embedded images to the cache."""
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(path)  # Not read-only: embedded images are only loaded in full mode
+    sheet = workbook.active
+    images = {image.anchor._from.row: image for image in sheet._images}
+    for row_number, values in enumerate(sheet.iter_rows(min_row=2, values_only=True), start=1):
+        row = dict(zip(('category', 'title', 'price', 'sku', 'description', 'size'), values))
+        thumbnail = 'N/A'
+        if row_number in images:
+            data = images[row_number]._data()
+            thumbnail = os.path.join(cache_dir, hashlib.sha256(data).hexdigest()[:32] + '.' + images[row_number].format)
+            if not os.path.exists(thumbnail):
+                with open(thumbnail, 'wb') as file:
+                    file.write(data)
+        yield record_of(row), thumbnail
+
+
+def merge_products(sources, images):
+    """Read every source and return ({key: MergedProduct} in first-seen order, {category: [key]})."""
+    products = {}
+    categories = {}
+    for path in sources:
+        category = category_of(path)
+        if path.lower().endswith('.xlsx'):
+            rows = read_xlsx(path, images.cache_dir)
+        else:
+            rows = ((record_of(row), None) for row in read_rows(path))
+        keys = categories.setdefault(category, [])
+        for record, thumbnail in rows:
+            key = product_key(record)
+            product = products.get(key)
+            if product is None:
+                product = products[key] = MergedProduct(record)
+            else:
+                # Fill fields a duplicate from another category has and the first copy lacked
+                for name in ('category', 'title', 'price', 'sku', 'description', 'size', 'image_url', 'url'):
+                    if getattr(product.record, name) in ('N/A', None) and getattr(record, name) not in ('N/A', None):
+                        setattr(product.record, name, getattr(record, name))
+            if product.image in (None, 'N/A'):
+                product.image = thumbnail if thumbnail not in (None, 'N/A') else None
+            if category not in product.categories:
+                product.categories.append(category)
+                keys.append(key)
+    # Download the thumbnails still missing, all at once, while nothing is written yet
+    for product in products.values():
+        if product.image is None and product.record.image_url:
+            product.image = images.submit(product.record.image_url)
+    return products, categories
+
+
+def sheet_title(name, used):
+    """A valid, unique worksheet name (at most 31 characters, no []:*?/\\)."""
+    title = ''.join('_' if character in INVALID_SHEET_CHARACTERS else character for character in name)[:31] or 'Sheet'
+    candidate, number = title, 2
+    while candidate.lower() in used:
+        suffix = f' ({number})'
+        candidate, number = title[:31 - len(suffix)] + suffix, number + 1
+    used.add(candidate.lower())
+    return candidate
+
+
+def write_catalog(products, categories, output_path):
+    """Write the master, per-category and category map sheets in one pass over the merged products."""
+    tmp_path = f'{output_path}.tmp'
+    workbook = xlsxwriter.Workbook(tmp_path, {'constant_memory': True})
+    used = set()
+
+    def add_sheet(name, headers, image_column=None):
+        sheet = workbook.add_worksheet(sheet_title(name, used))
+        sheet.write_row(0, 0, headers)
+        if image_column is not None:
+            sheet.set_column(image_column, image_column, 20)
+        return sheet
+
+    def write_product(sheet, row, product, extra=()):
+        sheet.write_row(row, 0, list(product.record.values()) + list(extra))
+        image = product.image.result() if hasattr(product.image, 'result') else product.image
+        if image and image != 'N/A' and os.path.exists(image):
+            # xlsxwriter stores identical image data once, however many sheets show it
+            sheet.insert_image(row, 6, image)
+
+    master = add_sheet('All Products', HEADERS + ['Categories', 'URL'], image_column=6)
+    for row, product in enumerate(products.values(), start=1):
+        write_product(master, row, product, (None, ', '.join(product.categories), product.record.url))
+
+    for category, keys in categories.items():
+        sheet = add_sheet(category, HEADERS, image_column=6)
+        for row, key in enumerate(keys, start=1):
+            write_product(sheet, row, products[key])
+
+    mapping = add_sheet('Category Map', ['Product', 'SKU', 'URL', 'Category'])
+    row = 1
+    for product in products.values():
+        for category in product.categories:
+            mapping.write_row(row, 0, [product.record.title, product.record.sku, product.record.url, category])
+            row += 1
+
+    workbook.close()
+    os.replace(tmp_path, output_path)
+
+
+def build_catalog(sources=None, output_path='capraleo_catalog.xlsx', images=None):
+    """Merge the given (or all found) outputs into one workbook and return (products, categories) counts."""
+    sources = sources or find_sources()
+    own_images = images is None
+    images = images or ImageStage()
+    try:
+        products, categories = merge_products(sources, images)
+        write_catalog(products, categories, output_path)
+    finally:
+        if own_images:
+            images.close()
+    listed = sum(len(keys) for keys in categories.values())
+    log('catalog', f"Merged {listed} listings from {len(sources)} outputs into {len(products)} products in {output_path}",
+        sources=len(sources), listings=listed, products=len(products), path=output_path)
+    return len(products), len(categories)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('sources', nargs='*', help='per-subcategory outputs (default: every *_product_data file here)')
+    parser.add_argument('--output', default='capraleo_catalog.xlsx')
+    parser.add_argument('--thumbnail-size', default='100x100', help='size of the embedded thumbnails, e.g. 300x300')
+    args = parser.parse_args()
+    images = ImageStage(sizes=parse_sizes(args.thumbnail_size))
+    try:
+        build_catalog(args.sources, args.output, images)
+    finally:
+        images.close()
+
+
+if __name__ == "__main__":
+    main()
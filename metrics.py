@@ -0,0 +1,132 @@
+import cProfile
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+# SCRAPER_LOG_FORMAT=json prints one JSON object per line instead of plain messages
+LOG_FORMAT = os.environ.get('SCRAPER_LOG_FORMAT', 'text')
+
+
+def log(event, message, **fields):
+    """Print a log line: the plain message, or a JSON object with the event name and fields."""
+    if LOG_FORMAT == 'json':
+        print(json.dumps({'ts': round(time.time(), 3), 'event': event, 'message': message, **fields}, default=str),
+              flush=True)
+    else:
+        print(message)
+
+
+def set_log_format(name):
+    """Switch between 'text' and 'json' log lines, e.g. from a command line option."""
+    global LOG_FORMAT
+    LOG_FORMAT = name
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+
+class Metrics:
+    """Per-stage timers and counters of one crawl, shared by every thread.
+
+    Stages are timed with `timer('fetch.http')` and the like; counters hold
+    pages, bytes fetched, cache hits, retries and so on. summary() reduces the
+    timings to p50/p95 per stage.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.perf_counter()
+            self.timings = defaultdict(list)  # stage -> [seconds]
+            self.counters = Counter()
+
+    @contextmanager
+    def timer(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - started)
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self.timings[stage].append(seconds)
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def summary(self):
+        """Return elapsed time, counters, pages/s and p50/p95 of every stage."""
+        with self._lock:
+            elapsed = time.perf_counter() - self.started
+            counters = dict(self.counters)
+            timings = {stage: list(values) for stage, values in self.timings.items()}
+        return {
+            'elapsed_s': round(elapsed, 3),
+            'pages_per_s': round(counters.get('pages', 0) / elapsed, 3) if elapsed else 0.0,
+            'products_per_s': round(counters.get('products', 0) / elapsed, 3) if elapsed else 0.0,
+            'counters': counters,
+            'stages': {
+                stage: {
+                    'count': len(values),
+                    'total_s': round(sum(values), 3),
+                    'p50_ms': round(percentile(values, 0.50) * 1000, 1),
+                    'p95_ms': round(percentile(values, 0.95) * 1000, 1),
+                }
+                for stage, values in sorted(timings.items())
+            },
+        }
+
+    def log_summary(self):
+        """Log the end-of-run summary, as one JSON line or a small table."""
+        summary = self.summary()
+        if LOG_FORMAT == 'json':
+            log('summary', 'Run summary', **summary)
+            return
+        counters = summary['counters']
+        print(f"Run summary: {summary['elapsed_s']:.1f}s, {counters.get('pages', 0)} pages "
+              f"({summary['pages_per_s']:.2f}/s), {counters.get('products', 0)} products "
+              f"({summary['products_per_s']:.2f}/s), {counters.get('bytes', 0) / 1e6:.2f} MB fetched")
+        for stage, stats in summary['stages'].items():
+            print(f"  {stage:<18} {stats['count']:>6} calls  p50 {stats['p50_ms']:>8.1f} ms  "
+                  f"p95 {stats['p95_ms']:>8.1f} ms  total {stats['total_s']:>8.2f} s")
+        others = {name: value for name, value in counters.items() if name not in ('pages', 'products', 'bytes')}
+        if others:
+            print("  " + ", ".join(f"{name}={value}" for name, value in sorted(others.items())))
+
+
+# Shared by every module of one process
+metrics = Metrics()
+
+
+@contextmanager
+def profiled(path=None):
+    """Run the enclosed block under cProfile when `path` is set, dump the stats there and print the top entries.
+
+    The stats file opens in snakeviz or `python -m pstats`. For py-spy, leave
+    this off and attach to the running process instead.
+    """
+    if not path:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        pstats.Stats(profiler, stream=sys.stdout).sort_stats('cumulative').print_stats(25)
+        log('profile', f"Profile written to {path}", path=path)
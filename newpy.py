@@ -1,53 +1,57 @@
-import undetected_chromedriver as uc
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from bs4 import BeautifulSoup
-import requests
+import argparse
+import fnmatch
 import os
+import signal
+import sys
+import threading
 import time
-from PIL import Image
-from io import BytesIO
-import openpyxl
-from openpyxl.drawing.image import Image as OpenpyxlImage
+from dataclasses import dataclass
+from metrics import log, metrics, profiled, set_log_format
 
-# Base URL
-base_url = "https://capraleo.com/"
+# bs4, requests, selenium, PIL, lxml and xlsxwriter are imported inside the functions that
+# need them, so `discover`, `export` and HTTP-only crawls never load the browser stack
+
+# Base URL (point CAPRALEO_BASE_URL at a local server to crawl saved pages offline)
+base_url = os.environ.get('CAPRALEO_BASE_URL', "https://capraleo.com/")
+
+def fetch_category_links(fetcher, profile):
+    """Fetch all category links matching the site profile's selector."""
+    from bs4 import BeautifulSoup
 
-def fetch_category_links(driver):
-    """Fetch all category links from the specified class."""
     try:
-        driver.get(base_url)
-        WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.CLASS_NAME, "ekit_badge_left")))
-        soup = BeautifulSoup(driver.page_source, 'html.parser')
-        category_elements = soup.find_all('a', class_='ekit_badge_left')
-        category_links = [a['href'] for a in category_elements if 'href' in a.attrs]
-        print(f"Found category links: {category_links}")
+        page = fetcher.fetch(profile.base_url, markers=(profile.category_marker,))
+        soup = BeautifulSoup(page.text, 'html.parser')
+        category_elements = soup.select(profile.category_links)
+        category_links = list(dict.fromkeys(a['href'] for a in category_elements if 'href' in a.attrs))
+        log('category_links', f"Found category links: {category_links}", links=category_links)
         return category_links
     except Exception as e:
-        print(f"Error fetching category links: {e}")
+        log('category_links_error', f"Error fetching category links: {e}", error=str(e))
         return []
 
-def fetch_sub_category_links(driver, category_link):
+def fetch_sub_category_links(fetcher, category_link):
     """Fetch all subcategory links under a given category."""
+    from bs4 import BeautifulSoup
+
     try:
-        driver.get(category_link)
-        WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.CLASS_NAME, "elementor-container")))
-        soup = BeautifulSoup(driver.page_source, 'html.parser')
+        page = fetcher.fetch(category_link, markers=('elementor-container',))
+        soup = BeautifulSoup(page.text, 'html.parser')
         sub_category_elements = soup.find_all('a', href=True)
-        sub_category_links = [a['href'] for a in sub_category_elements if "category" in a['href']]
-        print(f"Found subcategory links for {category_link}: {sub_category_links}")
+        sub_category_links = list(dict.fromkeys(a['href'] for a in sub_category_elements if "category" in a['href']))
+        log('subcategory_links', f"Found subcategory links for {category_link}: {sub_category_links}",
+            url=category_link, links=sub_category_links)
         return sub_category_links
     except Exception as e:
-        print(f"Error fetching subcategory links from {category_link}: {e}")
+        log('subcategory_links_error', f"Error fetching subcategory links from {category_link}: {e}",
+            url=category_link, error=str(e))
         return []
 
 def read_scraped_links(log_file_path):
-    """Read already scraped links from a log file."""
+    """Yield the already scraped links logged in a file."""
     if os.path.exists(log_file_path):
         with open(log_file_path, 'r') as file:
-            return set(line.strip() for line in file)
-    return set()
+            for line in file:
+                yield line.strip()
 
 def log_scraped_link(link, log_file_path):
     """Log the scraped link to avoid reprocessing."""
@@ -55,195 +59,743 @@ def log_scraped_link(link, log_file_path):
         with open(log_file_path, 'a') as file:
             file.write(link + '\n')
     except Exception as e:
-        print(f"Error logging scraped link {link}: {e}")
+        log('log_link_error', f"Error logging scraped link {link}: {e}", url=link, error=str(e))
+
+def parse_listing_page(html, profile=None):
+    """Return the product links on a listing page and whether it has a next page."""
+    with metrics.timer('parse.listing'):
+        return _parse_listing_page(html, profile or default_profile())
+
+def _parse_listing_page(html, profile):
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, 'html.parser')
+    li_elements = soup.select(profile.listing_items)
+    product_links = list(dict.fromkeys(a['href'] for a in (li.find('a', href=True) for li in li_elements) if a))
+    has_next_page = soup.select_one(profile.next_page) is not None
+    return product_links, has_next_page
+
+def default_profile():
+    """The capraleo.com profile, at CAPRALEO_BASE_URL when that is set."""
+    from site_profile import SiteProfile
+
+    return SiteProfile(base_url=base_url)
+
+@dataclass
+class CrawlContext:
+    """Services shared by every subcategory of one crawl."""
+    fetcher: object
+    images: object  # ImageStage
+    profile: object = None  # site_profile.SiteProfile of the site being crawled
+    store: object = None  # StateStore in incremental mode
+    catalog: object = None  # discovery.Catalog
+    ingest: str = 'html'  # 'json' builds records from Store API data wherever it is complete
+    dead_letters: object = None  # resilience.DeadLetters
+    frontier: object = None  # Frontier journal that lets an interrupted crawl resume
+    output_formats: tuple = ('xlsx',)
+    visited: object = None  # url_index.UrlIndex shared by every subcategory
+    cpu: object = None  # cpu_pool.CpuPool when parsing runs in worker processes
+    cache: object = None  # response_cache.ResponseCache that pages are written to or replayed from
+    quality: object = None  # validation.QualityReport every written product is checked against
+    rate_limits: object = None  # resilience.HostRateLimits shared by page and image requests
+    output_suffix: str = ''  # Added to output file names, so a dead-letter retry keeps the full outputs
+
+    def __post_init__(self):
+        self.profile = self.profile or default_profile()
+
+    def throttle(self, url):
+        """Wait until the host's request budget (SCRAPER_RATE) allows another request."""
+        if self.rate_limits is not None:
+            self.rate_limits.get(url).wait()
+
+    @property
+    def replay(self):
+        """True when pages come from the response cache instead of the network."""
+        return self.fetcher.name == 'replay'
+
+    def open_output(self, sub_category_name):
+        return SubCategoryOutput(sub_category_name, self.images, self.store, self.frontier, self.output_formats,
+                                 self.visited, self.profile.output_dir, track_links=not self.replay,
+                                 quality=self.quality, output_name=sub_category_name + self.output_suffix)
+
+    def catalog_record(self, link):
+        """Return the product's record built from Store API JSON, or None if the page must be scraped."""
+        if self.ingest != 'json' or self.catalog is None or link not in self.catalog.items:
+            return None
+        from discovery import is_complete, record_from_store_item
+
+        record = record_from_store_item(self.catalog.items[link])
+        return record if is_complete(record) else None
+
+    def dead_letter(self, kind, url, error, sub_category=None):
+        """Remember a URL that failed after every retry, for a later bulk retry."""
+        if self.dead_letters is not None:
+            self.dead_letters.add(kind, url, error, sub_category)
+        if kind == 'product' and self.frontier is not None:
+            self.frontier.mark_failed(sub_category, url)
+
+class SubCategoryOutput:
+    """Output files (the Excel workbook by default) and scraped-links log for one subcategory.
+
+    With a StateStore the output is incremental: every product is re-checked
+    with a conditional request, changed records go to the store, and the Excel
+    file is rebuilt from all stored records of the subcategory on save().
+    With a Frontier, records are journaled as they are scraped and the Excel
+    file is written from the journal on save(), so a resumed crawl keeps the
+    products scraped before it was interrupted.
+    """
+
+    def __init__(self, sub_category_name, images, store=None, frontier=None, formats=('xlsx',), visited=None,
+                 directory='', track_links=True, quality=None, output_name=None):
+        from sinks import make_sink
+        from url_index import UrlIndex
+
+        # File paths for the current subcategory
+        self.name = sub_category_name
+        self.log_file_path = os.path.join(directory, f'{sub_category_name}_scraped_links.txt')
+        # Each format adds its extension
+        self.output_base = os.path.join(directory, f'{output_name or sub_category_name}_product_data')
+        self.images = images  # Image stage shared by every subcategory
+        self.store = store
+        self.frontier = frontier
+        self.track_links = track_links  # False re-scrapes every product and leaves the links file alone
+        self.quality = quality
+        self.requeued = set()  # Products written incomplete, left out of the links so a retry fetches them again
+
+        # Ensure the necessary directories exist
+        for folder in (os.path.dirname(self.log_file_path), os.path.dirname(self.output_base)):
+            if folder and not os.path.exists(folder):
+                os.makedirs(folder)
+
+        # Links logged by earlier runs, in the shared index (which may persist them in a Bloom filter)
+        self.visited = visited if visited is not None else UrlIndex()
+        if track_links:
+            self.visited.update(read_scraped_links(self.log_file_path), sub_category_name)
+        self.unlogged_links = []
+        # Links done before an interrupted crawl only count for this crawl, so they never reach the filter
+        self.done = UrlIndex(prefix=self.visited.prefix)
+        if frontier is not None:
+            self.done.update(frontier.done_links(sub_category_name))
+            frontier.on_flush(self.write_unlogged_links)
+
+        # Rows are streamed to every output as they arrive; only Excel embeds the images. A run that
+        # re-scrapes everything (a replay) starts its outputs afresh instead of recovering leftover rows
+        recover = frontier is None and track_links
+        self.sinks = [make_sink(output_format, self.output_base, f"{sub_category_name} Data", recover=recover)
+                      for output_format in formats]
+        self.embeds_images = 'xlsx' in formats
+        self.closed = False
+        self.lock = threading.Lock()  # Browser workers may write to the same subcategory
+
+    def should_scrape(self, link):
+        """Skip links scraped by earlier runs, unless the store re-checks them for changes."""
+        if self.done.contains(link):
+            return False  # Scraped before this crawl was interrupted
+        return self.store is not None or not self.visited.contains(link, self.name)
+
+    def request_headers(self, link):
+        """Conditional request headers for a product we already have, if any."""
+        return self.store.conditional_headers(link) if self.store is not None else None
+
+    def write_product(self, record, response_headers=None):
+        """Write one product row to the Excel sheet; its image is added once downloaded."""
+        metrics.count('products')
+        image = self.images.submit(record.image_url) if self.embeds_images else None
+        if self.quality is not None:
+            from validation import REQUEUE_ISSUES
+
+            if REQUEUE_ISSUES.intersection(self.quality.check(self.name, record, image)):
+                with self.lock:
+                    self.requeued.add(record.url)
+        if self.frontier is not None:
+            self.frontier.mark_done(self.name, record)
+        if self.store is not None:
+            changed = self.store.save(self.name, record, response_headers)
+            log('product_saved', f"{'Updated' if changed else 'Unchanged'} product: {record.title} ({record.url})",
+                url=record.url, changed=changed)
+            return
+        if self.frontier is None:
+            with self.lock:
+                for sink in self.sinks:
+                    sink.write(record, image)
+        log('product_saved', f"Data saved in Excel: Category: {record.category}, Title: {record.title}, Price: {record.price}, SKU Combined: {record.sku}, Description: {record.description}, Size: {record.size}, Image: {record.image_url or 'N/A'}",
+            url=record.url, title=record.title)
 
-def download_and_resize_image(image_url, image_name, max_size=(100, 100)):
-    """Download and resize the image."""
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    }
+    def mark_unchanged(self, link):
+        """Note a product the server reported as not modified."""
+        self.store.touch(self.name, link)
+        log('not_modified', f"Not modified: {link}", url=link)
+
+    def log_link(self, link):
+        """Record a processed product link so later runs skip it."""
+        with self.lock:
+            if link in self.requeued:
+                return  # Dead-lettered by the quality check; SCRAPER_RETRY_DEAD must not skip it
+            self.visited.add(link, self.name)
+            if not self.track_links:
+                return
+            if self.frontier is None:
+                log_scraped_link(link, self.log_file_path)
+            else:
+                self.unlogged_links.append(link)
+
+    def write_unlogged_links(self):
+        """Log the links whose records the frontier has committed, so a crash never skips an unjournaled product."""
+        with self.lock:
+            links, self.unlogged_links = self.unlogged_links, []
+            for link in links:
+                log_scraped_link(link, self.log_file_path)
+
+    def save(self):
+        """Finish the output files; safe to call more than once."""
+        if not self.closed:
+            self.closed = True
+            journal = self.store if self.store is not None else self.frontier
+            if journal is not None:
+                for record in journal.records(self.name):
+                    image = self.images.submit(record.image_url) if self.embeds_images else None
+                    for sink in self.sinks:
+                        sink.write(record, image)
+            for sink in self.sinks:
+                sink.close()
+                kind = 'Excel file' if sink.extension == '.xlsx' else 'file'
+                log('output_saved', f"Data saved to {kind}: {sink.path}", path=sink.path)
+
+def parse_product(html, url=None, fields=None):
+    """Extract a product page into a ProductRecord, timing the parse."""
+    from extractor import PRODUCT_FIELDS, extract_product
+
+    with metrics.timer('parse.product'):
+        return extract_product(html, url, fields or PRODUCT_FIELDS)
+
+def scrape_product_data(html, output, url=None, response_headers=None, cpu=None, fields=None):
+    """Scrape product data from the page HTML and write to Excel."""
     try:
-        response = requests.get(image_url, headers=headers, stream=True)
-        response.raise_for_status()
-        img = Image.open(BytesIO(response.content))
-        img.thumbnail(max_size)  # Resize the image
-        img_path = os.path.join(image_folder, image_name)
-        img.save(img_path)
-        return img_path
+        record = cpu.parse(html, url, fields).result() if cpu is not None else parse_product(html, url, fields)
+        output.write_product(record, response_headers)
     except Exception as e:
-        print(f"Failed to download or resize image from {image_url}. Error: {e}")
-        return 'N/A'
+        log('parse_error', f"Failed to scrape product data. Error: {e}", url=url, error=str(e))
 
-def scrape_product_data(driver, sheet, row):
-    """Scrape product data from the webpage and write to Excel."""
-    try:
-        soup = BeautifulSoup(driver.page_source, 'html.parser')
-
-        # Extract data using BeautifulSoup
-        category = soup.find(class_='single-product-category')
-        title = soup.find(class_='product_title entry-title')
-        price_element = soup.find(class_='woocommerce-Price-amount')
-        sku_wrapper = soup.find(class_='sku_wrapper')
-        sku = soup.find(class_='sku')
-        description_div = soup.find('div', id='tab-description')
-        size = soup.find(class_='woocommerce-product-attributes-item__value')
-        image_tag = soup.find('img', class_='wp-post-image')  # Extract image with this class
-
-        # Extract text with default values if elements are not found
-        category_text = category.get_text(strip=True) if category else 'N/A'
-        title_text = title.get_text(strip=True) if title else 'N/A'
-        
-        if price_element:
-            price_currency = price_element.find(class_='woocommerce-Price-currencySymbol').get_text(strip=True) if price_element.find(class_='woocommerce-Price-currencySymbol') else 'N/A'
-            price_value = price_element.find('bdi').get_text(strip=True) if price_element.find('bdi') else 'N/A'
-            price_text = f"{price_currency} {price_value}"
+def iter_listing_pages(fetcher, sub_category_link, page_number=1, profile=None):
+    """Yield (page number, product links, has next page) for each listing page of a subcategory, from `page_number` on."""
+    profile = profile or default_profile()
+    while True:
+        page_url = profile.listing_url(sub_category_link, page_number)
+        page = fetcher.fetch(page_url, markers=(profile.listing_marker,))
+        product_links, has_next_page = parse_listing_page(page.text, profile)
+
+        if not product_links:
+            log('listing', f"No product links found on page {page_number} for subcategory: {sub_category_link}",
+                url=sub_category_link, page=page_number, products=0)
+            break  # Exit loop if no products are found on this page
         else:
-            price_text = 'N/A'
-        
-        sku_combined = f"{sku_wrapper.get_text(strip=True)} {sku.get_text(strip=True)}" if sku_wrapper and sku else 'N/A'
-        description_text = description_div.find('p').get_text(strip=True) if description_div and description_div.find('p') else 'N/A'
-        size_text = size.get_text(strip=True) if size else 'N/A'
-        
-        # Extract image URL and download the image
-        if image_tag:
-            image_url = image_tag['src']
-            image_name = image_url.split('/')[-1]
-            image_path = download_and_resize_image(image_url, image_name)
+            log('listing', f"Found {len(product_links)} product links on page {page_number} for subcategory: {sub_category_link}",
+                url=sub_category_link, page=page_number, products=len(product_links))
+
+        yield page_number, product_links, has_next_page
+
+        # The listing page we already fetched tells us whether there is a next page
+        if not has_next_page:
+            log('listing', f"No more pages found for subcategory: {sub_category_link}",
+                url=sub_category_link, page=page_number)
+            break  # Exit loop if no more pages are found
         else:
-            image_path = 'N/A'
-
-        # Write the data to the Excel file
-        sheet.cell(row=row, column=1, value=category_text)
-        sheet.cell(row=row, column=2, value=title_text)
-        sheet.cell(row=row, column=3, value=price_text)
-        sheet.cell(row=row, column=4, value=sku_combined)
-        sheet.cell(row=row, column=5, value=description_text)
-        sheet.cell(row=row, column=6, value=size_text)
-
-        if image_path != 'N/A':
-            img = OpenpyxlImage(image_path)
-            sheet.add_image(img, f"G{row}")
-        print(f"Data saved in Excel: Category: {category_text}, Title: {title_text}, Price: {price_text}, SKU Combined: {sku_combined}, Description: {description_text}, Size: {size_text}, Image: {image_path}")
-        
-    except Exception as e:
-        print(f"Failed to scrape product data. Error: {e}")
+            log('listing', f"Moving to next page for subcategory: {sub_category_link}",
+                url=sub_category_link, page=page_number)
+            page_number += 1
+
+def iter_product_links(context, sub_category_link, sub_category_name):
+    """Yield batches of product links for a subcategory, straight from discovery when it knows them.
+
+    With a frontier, links listed before an interruption come first and the
+    listing walk carries on from the next page.
+    """
+    catalog, frontier = context.catalog, context.frontier
+    listed_pages = 0
+    if frontier is not None:
+        listed_pages, complete = frontier.listing_progress(sub_category_name)
+        if listed_pages or complete:
+            product_links = frontier.product_links(sub_category_name)
+            log('listing', f"Resuming subcategory {sub_category_name} with {len(product_links)} product links from the frontier",
+                url=sub_category_link, products=len(product_links), source='frontier')
+            yield product_links
+            if complete:
+                return
+
+    if catalog is not None and sub_category_name in catalog.products:
+        product_links = catalog.products[sub_category_name]
+        log('listing', f"Found {len(product_links)} product links via {catalog.source} for subcategory: {sub_category_link}",
+            url=sub_category_link, products=len(product_links), source=catalog.source)
+        if frontier is not None:
+            frontier.add_listing_page(sub_category_name, 1, product_links, last=True)
+        yield product_links
+        return
+
+    for page_number, product_links, has_next_page in iter_listing_pages(context.fetcher, sub_category_link,
+                                                                        listed_pages + 1, context.profile):
+        if frontier is not None:
+            frontier.add_listing_page(sub_category_name, page_number, product_links, last=not has_next_page)
+        yield product_links
+    if frontier is not None:
+        frontier.finish_listing(sub_category_name)
+
+def scrape_product_link(context, output, link):
+    """Scrape one product into the output and log the link; return True if its page was fetched."""
+    log('product', f"Processing product link: {link}", url=link)
+    record = context.catalog_record(link)
+    if record is not None:
+        log('product_json', f"Using Store API data for product: {link}", url=link)
+        output.write_product(record)
+        output.log_link(link)
+        return False
 
-def process_sub_category(driver, sub_category_link, sub_category_name):
+    if context.frontier is not None:
+        context.frontier.mark_in_flight(output.name, link)
+    # To avoid being flagged for scraping too quickly; browser workers share the same budget
+    context.throttle(link)
+    product_page = context.fetcher.fetch(link, markers=(context.profile.product_marker,),
+                                         headers=output.request_headers(link))
+    if product_page.status == 304:
+        output.mark_unchanged(link)
+    else:
+        log('product_page', f"Opened product page: {link} ({product_page.engine})",
+            url=link, engine=product_page.engine)
+        scrape_product_data(product_page.text, output, link, product_page.headers, context.cpu,
+                            context.profile.product_fields)
+    output.log_link(link)
+    return True
+
+def process_sub_category(context, sub_category_link, sub_category_name):
     """Process each subcategory by scraping its products."""
-    print(f"Processing subcategory: {sub_category_name}")
+    log('subcategory', f"Processing subcategory: {sub_category_name}", sub_category=sub_category_name)
+    output = context.open_output(sub_category_name)
+
+    try:
+        for product_links in iter_product_links(context, sub_category_link, sub_category_name):
+            for link in product_links:
+                if not output.should_scrape(link):
+                    log('skipped', f"Link already scraped: {link}", url=link)
+                    continue
+                
+                try:
+                    scrape_product_link(context, output, link)
+                    
+                except Exception as e:
+                    log('product_error', f"Error processing link {link}: {e}", url=link, error=str(e))
+                    context.dead_letter('product', link, e, sub_category_name)
+                    continue
+    except Exception as e:
+        log('listing_error', f"Error listing products for subcategory {sub_category_name}: {e}",
+            sub_category=sub_category_name, error=str(e))
+        context.dead_letter('listing', sub_category_link, e, sub_category_name)
+    finally:
+        output.save()  # Keep what was scraped even if the run is interrupted
+
+def process_sub_categories_in_parallel(context, sub_category_links, workers):
+    """Scrape subcategories with several browser workers that steal products from busy subcategories."""
+    from browser_pool import steal_work
 
-    # File paths for the current subcategory
-    log_file_path = f'{sub_category_name}_scraped_links.txt'
-    excel_file_path = f'{sub_category_name}_product_data.xlsx'
-    global image_folder
-    image_folder = f'images/{sub_category_name}'  # Unique image folder for each subcategory
+    groups = {}
+    for sub_category_link, sub_category_name in sub_category_links:
+        log('subcategory', f"Processing subcategory: {sub_category_name}", sub_category=sub_category_name)
+        output = context.open_output(sub_category_name)
+        try:
+            groups[output] = [link for product_links in iter_product_links(context, sub_category_link, sub_category_name)
+                              for link in product_links if output.should_scrape(link)]
+        except Exception as e:
+            log('listing_error', f"Error listing products for subcategory {sub_category_name}: {e}",
+                sub_category=sub_category_name, error=str(e))
+            context.dead_letter('listing', sub_category_link, e, sub_category_name)
+            groups[output] = []
 
-    # Ensure the image folder and necessary directories exist
-    if not os.path.exists(image_folder):
-        os.makedirs(image_folder)
+    def scrape(output, link):
+        try:
+            scrape_product_link(context, output, link)
+        except Exception as e:
+            log('product_error', f"Error processing link {link}: {e}", url=link, error=str(e))
+            context.dead_letter('product', link, e, output.name)
 
-    # Ensure the log file path and Excel file path directories exist
-    log_file_dir = os.path.dirname(log_file_path)
-    if log_file_dir and not os.path.exists(log_file_dir):
-        os.makedirs(log_file_dir)
+    try:
+        steal_work(groups, workers, scrape)
+    finally:
+        for output in groups:
+            output.save()
 
-    excel_file_dir = os.path.dirname(excel_file_path)
-    if excel_file_dir and not os.path.exists(excel_file_dir):
-        os.makedirs(excel_file_dir)
+def crawl(context, sub_category_links, concurrency, browsers):
+    """Scrape every subcategory with the pipeline, the browser workers or the serial loop."""
+    if concurrency > 1:
+        from pipeline import run_pipeline
 
-    scraped_links = read_scraped_links(log_file_path)
+        run_pipeline(context, sub_category_links, concurrency=concurrency,
+                     per_host=context.profile.setting('per_host', 'SCRAPER_PER_HOST', 4, int),
+                     rate=1e9 if context.replay else context.profile.setting('rate', 'SCRAPER_RATE', 2.0, float))
+    elif browsers > 1:
+        process_sub_categories_in_parallel(context, sub_category_links, browsers)
+    else:
+        for sub_category_link, sub_category_name in sub_category_links:
+            process_sub_category(context, sub_category_link, sub_category_name)
 
-    # Prepare Excel file
-    workbook = openpyxl.Workbook()
-    sheet = workbook.active
-    sheet.title = f"{sub_category_name} Data"
-    sheet.append(['Category', 'Title', 'Price', 'SKU Combined', 'Description', 'Size', 'Image'])
-    sheet.column_dimensions['G'].width = 20  # Adjust the width as needed
+def load_catalog(context, policy):
+    """Run Store API or sitemap discovery into the context's catalog, unless SCRAPER_DISCOVERY is html."""
+    from discovery import discover_catalog
+    from fetcher import make_fetcher
 
-    row = 2
+    strategy = context.profile.setting('discovery', 'SCRAPER_DISCOVERY', 'auto')
+    if strategy != 'html':
+        # JSON and XML never need the browser
+        discovery_fetcher = make_fetcher('replay' if context.replay else 'http', policy=policy, cache=context.cache)
+        try:
+            context.catalog = discover_catalog(discovery_fetcher, context.profile.base_url, strategy)
+        finally:
+            discovery_fetcher.close()
 
-    page_number = 1
-    while True:
-        page_url = f"{sub_category_link}/page/{page_number}/"
-        new_page_url =  page_url
-        driver.get(page_url)
-        WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.CLASS_NAME, "products.columns-4")))
+def discover_sub_categories(context, policy):
+    """Run discovery into the context's catalog and return the (link, name) subcategories to crawl."""
+    profile = context.profile
+    load_catalog(context, policy)
+    category_links = fetch_category_links(context.fetcher, profile)
+    if not category_links and context.catalog is not None:
+        category_links = list(context.catalog.category_links.values())
+    return [(link, link.split('/')[-2]) for link in category_links]
 
-        li_elements = driver.find_elements(By.CSS_SELECTOR, ".products.columns-4 li")
-        product_links = [li.find_element(By.TAG_NAME, 'a').get_attribute('href') for li in li_elements if li.find_element(By.TAG_NAME, 'a')]
+def dead_letter_links(dead_letters):
+    """Return the failed listing and product URLs of the dead-letter list as (link, name) pairs, a Catalog and the entries.
 
-        if not product_links:
-            print(f"No product links found on page {page_number} for subcategory: {sub_category_link}")
-            break  # Exit loop if no products are found on this page
-        else:
-            print(f"Found {len(product_links)} product links on page {page_number} for subcategory: {sub_category_link}")
+    Subcategories whose listing failed are walked again; for the others only the
+    failed products are listed, through the same Catalog that discovery fills.
+    The entries stay in the list until the retry is done.
+    """
+    from discovery import Catalog
+
+    listing_entries, product_entries = dead_letters.entries('listing'), dead_letters.entries('product')
+    listings = {entry['sub_category']: entry['url'] for entry in listing_entries}
+    catalog = Catalog(source='dead letters')
+    for entry in product_entries:
+        if entry['sub_category'] not in listings:
+            catalog.products.setdefault(entry['sub_category'], []).append(entry['url'])
+    sub_category_links = [(link, name) for name, link in listings.items()]
+    sub_category_links += [(name, name) for name in catalog.products]
+    return sub_category_links, catalog, listing_entries + product_entries
 
-        for link in product_links:
-            if link in scraped_links:
-                print(f"Link already scraped: {link}")
-                continue
-            
+def output_formats():
+    """Output formats from SCRAPER_OUTPUTS (default xlsx), leaving out Parquet when pyarrow is missing."""
+    formats = [name.strip() for name in os.environ.get('SCRAPER_OUTPUTS', 'xlsx').split(',') if name.strip()]
+    if 'parquet' in formats:
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            log('output_format', "pyarrow is not installed, skipping the parquet output", format='parquet')
+            formats.remove('parquet')
+    return tuple(formats or ['xlsx'])
+
+def filter_sub_categories(sub_category_links, patterns):
+    """Keep the (link, name) subcategories whose name matches one of the comma separated glob patterns."""
+    patterns = [pattern.strip() for pattern in patterns.split(',') if pattern.strip()]
+    if not patterns:
+        return sub_category_links
+    return [(link, name) for link, name in sub_category_links
+            if any(fnmatch.fnmatch(name, pattern) for pattern in patterns)]
+
+def main():
+    """Crawl capraleo.com, or the SCRAPER_SITES profiles side by side, as the SCRAPER_* variables configure.
+
+    `newpy.py crawl --help` lists the variables next to the options that set them.
+    """
+    from site_profile import load_profile
+
+    # Turn `kill` into a normal exit so open Excel files are finished
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(1))
+    cpu_workers = int(os.environ.get('SCRAPER_CPU_WORKERS', 0))
+    cpu = None
+    if cpu_workers:
+        from cpu_pool import CpuPool
+
+        cpu = CpuPool(cpu_workers, chunk_size=int(os.environ.get('SCRAPER_CPU_CHUNK', 16)))
+    metrics.reset()
+    try:
+        with profiled(os.environ.get('SCRAPER_PROFILE')):
+            site_paths = [path.strip() for path in os.environ.get('SCRAPER_SITES', '').split(',') if path.strip()]
+            if site_paths:
+                crawl_sites([load_profile(path) for path in site_paths], cpu)
+            else:
+                crawl_site(default_profile(), cpu)
+    except Exception as e:
+        log('error', f"An error occurred: {e}", error=str(e))
+    finally:
+        if cpu is not None:
+            cpu.close()
+        metrics.log_summary()
+
+def crawl_sites(profiles, cpu=None):
+    """Crawl several sites at once, one thread each.
+
+    Every site gets its own fetcher, circuit breakers, rate limits and journals,
+    so a slow or failing supplier only holds up its own crawl. Sites without
+    an output_dir write into a directory named after the profile.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    for profile in profiles:
+        profile.output_dir = profile.output_dir or profile.name
+    log('sites', f"Crawling {len(profiles)} sites: {', '.join(profile.name for profile in profiles)}",
+        sites=[profile.name for profile in profiles])
+    with ThreadPoolExecutor(len(profiles), thread_name_prefix='site') as executor:
+        for profile, future in [(profile, executor.submit(crawl_site, profile, cpu)) for profile in profiles]:
             try:
-                print(f"Processing product link: {link}")
-                driver.get(link)
-                WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.TAG_NAME, "body")))
-                print(f"Opened product page: {link}")
-                
-                scrape_product_data(driver, sheet, row)
-                row += 1
-                log_scraped_link(link, log_file_path)
-                time.sleep(1)  # To avoid being flagged for scraping too quickly
-                
+                future.result()
             except Exception as e:
-                print(f"Error processing link {link}: {e}")
-                continue
-       
+                log('error', f"Crawl of {profile.name} failed: {e}", site=profile.name, error=str(e))
 
-        # Check if there's a next page
-        try:
-            # Redirect to the main subcategory page to check for additional pages
-            driver.get(new_page_url)
-            WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.CLASS_NAME, "products.columns-4")))
-            soup = BeautifulSoup(driver.page_source, 'html.parser')
-            next_page = soup.find('a', class_='next page-numbers')
-            if not next_page:
-                print(f"No more pages found for subcategory: {sub_category_link}")
-                break  # Exit loop if no more pages are found
+def crawl_site(profile, cpu=None):
+    """Crawl one site described by a SiteProfile."""
+    from fetcher import make_fetcher
+    from frontier import Frontier
+    from images import ImageStage, parse_sizes
+    from resilience import DeadLetters, HostBreakers, HostRateLimits, RetryPolicy
+    from response_cache import ResponseCache
+    from url_index import BloomFilter, UrlIndex
+    from validation import QualityReport
+
+    def site_path(variable, default):
+        return os.path.join(profile.output_dir, os.environ.get(variable, default))
+
+    if profile.output_dir:
+        os.makedirs(profile.output_dir, exist_ok=True)
+    browsers = int(os.environ.get('SCRAPER_BROWSERS', 1))
+    policy = RetryPolicy(attempts=int(os.environ.get('SCRAPER_RETRIES', 4)))
+    breakers = HostBreakers()  # Shared by pages and images: one struggling host pauses both
+    dead_letters = DeadLetters(site_path('SCRAPER_DEAD_LETTERS', 'dead_letters.jsonl'))
+    engine = os.environ.get('SCRAPER_ENGINE', 'auto')
+    cache = None
+    if os.environ.get('SCRAPER_HTTP_CACHE') or engine == 'replay':
+        cache = ResponseCache(site_path('SCRAPER_HTTP_CACHE', 'http_cache'))
+    concurrency = profile.setting('concurrency', 'SCRAPER_CONCURRENCY', 8, int)
+    fetcher = make_fetcher(engine, browsers=browsers, policy=policy, breakers=breakers, cache=cache,
+                           lean=os.environ.get('SCRAPER_LEAN_BROWSER') == '1', blocked_urls=profile.blocked_urls,
+                           connections=concurrency)
+    # Pages and images come from the same supplier host, so they draw on one per-host request budget
+    rate_limits = HostRateLimits(1e9 if engine == 'replay' else profile.setting('rate', 'SCRAPER_RATE', 2.0, float),
+                                 profile.setting('per_host', 'SCRAPER_PER_HOST', 4, int))
+    images = ImageStage(workers=int(os.environ.get('SCRAPER_IMAGE_WORKERS', 4)), policy=policy, breakers=breakers,
+                        dead_letters=dead_letters, cpu=cpu, offline=engine == 'replay',
+                        sizes=parse_sizes(os.environ.get('SCRAPER_THUMBNAIL_SIZES', '100x100')), rate_limits=rate_limits)
+    store = None
+    if os.environ.get('SCRAPER_INCREMENTAL') == '1':
+        from state_store import StateStore
+
+        store = StateStore(site_path('SCRAPER_STATE_DB', 'crawl_state.db'))
+    bloom = None
+    # A replay re-extracts every product, so it starts from an empty in-memory index and leaves the filter alone
+    if os.environ.get('SCRAPER_URL_BLOOM') and engine != 'replay':
+        bloom = BloomFilter(site_path('SCRAPER_URL_BLOOM', ''), int(os.environ.get('SCRAPER_URL_BLOOM_CAPACITY', 1_000_000)))
+    visited = UrlIndex(prefix=profile.base_url, bloom=bloom)
+    context = CrawlContext(fetcher, images, profile, store, ingest=profile.setting('ingest', 'SCRAPER_INGEST', 'html'),
+                           dead_letters=dead_letters, output_formats=output_formats(), visited=visited,
+                           cpu=cpu, cache=cache, quality=QualityReport(dead_letters), rate_limits=rate_limits)
+    frontier = None
+    retried = None
+    try:
+        if os.environ.get('SCRAPER_RETRY_DEAD') == '1':
+            sub_category_links, context.catalog, retried = dead_letter_links(dead_letters)
+            # Retried rows go next to the subcategory's outputs instead of replacing them; merge.py joins them
+            context.output_suffix = time.strftime('_retry-%Y%m%d-%H%M%S')
+            log('retry_dead', f"Retrying {len(sub_category_links)} subcategories from {dead_letters.path}",
+                path=dead_letters.path, sub_categories=len(sub_category_links))
+        elif context.replay:
+            # A replay re-extracts everything, so it neither resumes nor journals a crawl
+            log('replay', f"Replaying the crawl from {cache.directory}", path=cache.directory)
+            sub_category_links = discover_sub_categories(context, policy)
+        else:
+            frontier = context.frontier = Frontier(site_path('SCRAPER_FRONTIER_DB', 'crawl_frontier.db'))
+            if frontier.start():
+                sub_category_links = frontier.sub_categories()
+                if context.ingest == 'json':
+                    load_catalog(context, policy)  # The subcategories are journaled, the Store API records are not
+                log('resume', f"Resuming interrupted crawl of {len(sub_category_links)} subcategories from {frontier.path}",
+                    path=frontier.path, sub_categories=len(sub_category_links))
             else:
-                print(f"Moving to next page for subcategory: {sub_category_link}")
-                page_number += 1
-        except Exception as e:
-            print(f"Error checking for additional pages: {e}")
-            break  # Exit loop if there's an error checking for next page
-
-    workbook.save(excel_file_path)
-    print(f"Data saved to Excel file: {excel_file_path}")
-
-try:
-    options = uc.ChromeOptions()
-    options.add_argument("--headless=new")  # Enable new headless mode
-    options.add_argument("--disable-gpu")  # Disable GPU usage
-    options.add_argument("--disable-extensions")  # Disable extensions
-    options.add_argument("--no-sandbox")  # Disable sandbox mode for security
-    options.add_argument("--disable-dev-shm-usage")  # Prevents issues on systems with low memory
-    options.add_argument("--disable-blink-features=AutomationControlled")  # Avoid detection as automated
-
-    with uc.Chrome(options=options) as driver:
-        print("Driver initialized successfully in headless mode.")
-        category_links = fetch_category_links(driver)
-        
-        if not category_links:
-            print("No category links found. Exiting.")
+                sub_category_links = discover_sub_categories(context, policy)
+                frontier.add_sub_categories(sub_category_links)
+
+        sub_category_links = filter_sub_categories(sub_category_links, os.environ.get('SCRAPER_CATEGORIES', ''))
+        if not sub_category_links:
+            log('no_categories', "No category links found. Exiting.")
         else:
-            for sub_category_link in category_links:  # Using category_links directly
-                sub_category_name = sub_category_link.split('/')[-2]
-                process_sub_category(driver, sub_category_link, sub_category_name)
+            crawl(context, sub_category_links, concurrency, browsers)
+            if frontier is not None:
+                frontier.finish()
+        if retried is not None:
+            # Failed images are fetched again into the image cache, which export and merge embed from
+            image_entries = dead_letters.entries('image')
+            for future in [images.submit(entry['url']) for entry in image_entries]:
+                future.result()
+            dead_letters.remove(retried + image_entries)  # URLs that failed again were recorded anew during the retry
 
-except Exception as e:
-    print(f"An error occurred: {e}")
+    finally:
+        images.close()
+        fetcher.close()
+        if store is not None:
+            store.close()
+        if frontier is not None:
+            frontier.close()
+        visited.close()
+        if context.quality.categories:
+            context.quality.write(site_path('SCRAPER_QUALITY_REPORT', 'quality_report.json'))
 
-finally:
+# Command line options of `crawl`, each setting the environment variable main() reads
+CRAWL_OPTIONS = [
+    ('--base-url', 'CAPRALEO_BASE_URL', {'help': 'site to crawl'}),
+    ('--engine', 'SCRAPER_ENGINE', {'choices': ['auto', 'http', 'browser', 'replay'],
+                                    'help': 'replay reads pages from the response cache only'}),
+    ('--http-cache', 'SCRAPER_HTTP_CACHE', {'help': 'directory to keep every fetched page in'}),
+    ('--concurrency', 'SCRAPER_CONCURRENCY', {'type': int, 'help': 'requests in flight (8); 1 runs the serial loop'}),
+    ('--per-host', 'SCRAPER_PER_HOST', {'type': int, 'help': 'concurrent requests per host (4)'}),
+    ('--rate', 'SCRAPER_RATE', {'type': float, 'help': 'requests/s per host'}),
+    ('--browsers', 'SCRAPER_BROWSERS', {'type': int, 'help': 'browser workers of the serial loop'}),
+    ('--lean-browser', 'SCRAPER_LEAN_BROWSER', {'action': 'store_const', 'const': '1',
+                                                'help': 'block images, fonts, media and trackers in Chrome'}),
+    ('--image-workers', 'SCRAPER_IMAGE_WORKERS', {'type': int, 'help': 'threads downloading images (4)'}),
+    ('--thumbnail-sizes', 'SCRAPER_THUMBNAIL_SIZES', {'help': 'comma separated, e.g. "100x100,300x300"; '
+                                                              'the first is embedded in Excel'}),
+    ('--discovery', 'SCRAPER_DISCOVERY', {'choices': ['auto', 'store-api', 'sitemap', 'html'],
+                                          'help': 'auto falls back to walking listing pages'}),
+    ('--ingest', 'SCRAPER_INGEST', {'choices': ['html', 'json'],
+                                    'help': 'json takes products from the Store API, fetching only incomplete ones'}),
+    ('--outputs', 'SCRAPER_OUTPUTS', {'help': 'comma separated: xlsx, jsonl, csv, parquet'}),
+    ('--categories', 'SCRAPER_CATEGORIES', {'help': 'comma separated subcategory name patterns, e.g. "forceps,*-forceps"'}),
+    ('--retries', 'SCRAPER_RETRIES', {'type': int, 'help': 'attempts per request before it is dead-lettered (4)'}),
+    ('--cpu-workers', 'SCRAPER_CPU_WORKERS', {'type': int, 'help': 'parse and resize in this many processes'}),
+    ('--cpu-chunk', 'SCRAPER_CPU_CHUNK', {'type': int, 'help': 'jobs sent to a worker process at once'}),
+    ('--sites', 'SCRAPER_SITES', {'help': 'comma separated site profile files (JSON or YAML) to crawl at once; '
+                                          'their settings take precedence over these options'}),
+    ('--url-bloom', 'SCRAPER_URL_BLOOM', {'help': 'keep visited links in an on-disk Bloom filter at this path'}),
+    ('--profile', 'SCRAPER_PROFILE', {'help': 'write cProfile stats of the crawl to this file'}),
+    ('--incremental', 'SCRAPER_INCREMENTAL', {'action': 'store_const', 'const': '1',
+                                              'help': 're-check seen products against the state store'}),
+    ('--retry-dead', 'SCRAPER_RETRY_DEAD', {'action': 'store_const', 'const': '1',
+                                            'help': 'only crawl the URLs in the dead-letter list again'}),
+]
+
+# Variables without an option of their own, shown under `crawl --help`
+CRAWL_EPILOG = """\
+file locations, relative to a site's output directory:
+  SCRAPER_FRONTIER_DB     crawl journal an interrupted run resumes from (crawl_frontier.db)
+  SCRAPER_DEAD_LETTERS    URLs that still failed after the retries (dead_letters.jsonl)
+  SCRAPER_QUALITY_REPORT  per-category validation results (quality_report.json)
+  SCRAPER_STATE_DB        product store of --incremental (crawl_state.db)
+other variables:
+  SCRAPER_URL_BLOOM_CAPACITY  links the --url-bloom filter is sized for (1000000)
+  SCRAPER_LOG_FORMAT          text or json, like --log-format
+"""
+
+def crawl_command(args):
+    global base_url
+    for flag, variable, _ in CRAWL_OPTIONS:
+        value = getattr(args, flag[2:].replace('-', '_'))
+        if value is not None:
+            os.environ[variable] = str(value)
+    base_url = os.environ.get('CAPRALEO_BASE_URL', base_url)
+    main()
+
+def discover_command(args):
+    """List what bulk discovery finds, without crawling."""
+    import json
+    from discovery import discover_catalog
+    from fetcher import HttpFetcher
+
+    site_url = base_url
+    if args.site:
+        from site_profile import load_profile
+
+        site_url = load_profile(args.site).base_url
+    fetcher = HttpFetcher()
     try:
-        driver.quit()
-    except Exception as e:
-        print(f"Failed to quit driver: {e}")
+        catalog = discover_catalog(fetcher, args.base_url or site_url, args.strategy)
+    finally:
+        fetcher.close()
+    for slug, link in catalog.category_links.items():
+        print(f"{slug:<40} {len(catalog.products.get(slug, [])):>6} products  {link}")
+    print(f"{len(catalog.category_links)} categories and {len(catalog.items)} products via {catalog.source}")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump({'source': catalog.source, 'category_links': catalog.category_links,
+                       'products': catalog.products}, file, indent=2)
+
+def export_command(args):
+    """Build Excel workbooks from JSONL/CSV/Parquet outputs, or merge every output into one catalog."""
+    from export import export_excel
+    from images import ImageStage, parse_sizes
+    from merge import build_catalog, find_sources
+
+    sources = args.sources
+    if not args.merge:
+        sources = sources or [path for path in find_sources() if not path.endswith('.xlsx')]
+        if args.output and len(sources) != 1:
+            raise SystemExit('--output needs exactly one source')
+    images = ImageStage(sizes=parse_sizes(args.thumbnail_size))
+    try:
+        if args.merge:
+            build_catalog(sources, args.output or 'capraleo_catalog.xlsx', images)
+        else:
+            for source in sources:
+                export_excel(source, args.output, images)
+    finally:
+        images.close()
+
+def bench_command(args):
+    """Run bench_crawl.py or bench_extractor.py with the remaining arguments."""
+    module = __import__('bench_crawl' if args.target == 'crawl' else 'bench_extractor')
+    sys.argv = [module.__file__] + args.args
+    module.main()
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='newpy', description='Scrape the capraleo.com product catalog.')
+    parser.add_argument('--log-format', choices=['text', 'json'], help='SCRAPER_LOG_FORMAT')
+    commands = parser.add_subparsers(dest='command')
+
+    crawl_parser = commands.add_parser('crawl', help='crawl the site into per-subcategory outputs (the default)',
+                                       epilog=CRAWL_EPILOG, formatter_class=argparse.RawDescriptionHelpFormatter)
+    for flag, variable, options in CRAWL_OPTIONS:
+        crawl_parser.add_argument(flag, **dict(options, help=f"{options.get('help', '')} ({variable})".lstrip()))
+    crawl_parser.set_defaults(handler=crawl_command)
+
+    discover_parser = commands.add_parser('discover', help='list categories and products through the Store API or sitemaps')
+    discover_parser.add_argument('--base-url')
+    discover_parser.add_argument('--site', help='site profile file to take the base URL from')
+    discover_parser.add_argument('--strategy', default='auto', choices=['auto', 'store-api', 'sitemap'])
+    discover_parser.add_argument('--output', help='also write the catalog to this JSON file')
+    discover_parser.set_defaults(handler=discover_command)
+
+    export_parser = commands.add_parser('export', help='build image-embedded workbooks from crawl outputs')
+    export_parser.add_argument('sources', nargs='*', help='outputs to export (default: every *_product_data file here)')
+    export_parser.add_argument('--output', help='workbook path')
+    export_parser.add_argument('--merge', action='store_true', help='merge all sources into one deduplicated catalog')
+    export_parser.add_argument('--thumbnail-size', default='100x100',
+                               help='embed this of the crawl\'s thumbnail sizes, e.g. 300x300')
+    export_parser.set_defaults(handler=export_command)
+
+    bench_parser = commands.add_parser('bench', help='run the offline crawl or extractor benchmark')
+    bench_parser.add_argument('target', choices=['crawl', 'extractor'])
+    bench_parser.add_argument('args', nargs=argparse.REMAINDER, help='arguments for the benchmark')
+    bench_parser.set_defaults(handler=bench_command)
+    return parser
+
+def cli(argv=None):
+    """Run a subcommand; with none (or only crawl options) it crawls, like the old `python newpy.py`."""
+    argv = list(sys.argv[1:] if argv is None else argv)
+    # Take the global options out first, in any form argparse accepts, to see whether a subcommand follows
+    global_parser = argparse.ArgumentParser(add_help=False, allow_abbrev=False)
+    global_parser.add_argument('--log-format')
+    global_args, rest = global_parser.parse_known_args(argv)
+    if rest[:1] not in (['crawl'], ['discover'], ['export'], ['bench'], ['-h'], ['--help']):
+        rest.insert(0, 'crawl')
+    args = build_parser().parse_args((['--log-format', global_args.log_format] if global_args.log_format else []) + rest)
+    if args.log_format:
+        set_log_format(args.log_format)
+    args.handler(args)
+
+if __name__ == "__main__":
+    import multiprocessing
+
+    multiprocessing.freeze_support()  # Worker processes of a PyInstaller build start here
+    cli()
@@ -0,0 +1,197 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from urllib.parse import urlsplit
+
+from metrics import log
+from newpy import parse_listing_page, parse_product
+from resilience import HostRateLimits
+
+# Sentinel that tells the next stage its upstream has finished
+DONE = object()
+
+
+class HostLimiter:
+    """Cap requests globally and per host, and rate limit each host with a token bucket.
+
+    Pass the crawl's HostRateLimits to share each host's bucket with the image
+    downloads, so one budget covers every request to a supplier.
+    """
+
+    def __init__(self, concurrency=8, per_host=4, rate=2.0, rate_limits=None):
+        self.per_host = per_host
+        self.rate_limits = rate_limits or HostRateLimits(rate, per_host)
+        self.global_slots = asyncio.Semaphore(concurrency)
+        self.hosts = {}
+
+    @asynccontextmanager
+    async def slot(self, url):
+        host = urlsplit(url).netloc
+        if host not in self.hosts:
+            self.hosts[host] = asyncio.Semaphore(self.per_host)
+        async with self.hosts[host]:
+            await self.rate_limits.get(url).acquire()
+            async with self.global_slots:
+                yield
+
+
+class CrawlPipeline:
+    """Crawl subcategories as discovery -> fetch -> parse -> sink stages joined by bounded queues.
+
+    Images are handed to the ImageStage's thread pool as products are parsed,
+    and each row gets its image once the download finishes.
+    """
+
+    def __init__(self, context, concurrency=8, per_host=4, rate=2.0, queue_size=100, parse_workers=2):
+        self.context = context
+        self.fetcher = context.fetcher
+        self.profile = context.profile
+        self.concurrency = concurrency
+        # With worker processes, keep enough pages in flight to fill their chunks
+        self.parse_workers = context.cpu.max_pending if context.cpu is not None else parse_workers
+        self.limiter = HostLimiter(concurrency, per_host, rate, context.rate_limits)
+        self.fetch_queue = asyncio.Queue(queue_size)
+        self.parse_queue = asyncio.Queue(queue_size)
+        self.sink_queue = asyncio.Queue(queue_size)
+        self.outputs = {}
+
+    async def fetch(self, url, markers, headers=None):
+        async with self.limiter.slot(url):
+            return await asyncio.to_thread(self.fetcher.fetch, url, markers, headers)
+
+    async def discover(self, sub_category_link, sub_category_name):
+        """Queue the unseen product links of one subcategory, walking its listing pages unless discovery listed them."""
+        log('subcategory', f"Processing subcategory: {sub_category_name}", sub_category=sub_category_name)
+        output = self.outputs[sub_category_name] = self.context.open_output(sub_category_name)
+        catalog, frontier = self.context.catalog, self.context.frontier
+        page_number = 1
+        if frontier is not None:
+            listed_pages, complete = frontier.listing_progress(sub_category_name)
+            if listed_pages or complete:
+                product_links = frontier.product_links(sub_category_name)
+                log('listing', f"Resuming subcategory {sub_category_name} with {len(product_links)} product links from the frontier",
+                    url=sub_category_link, products=len(product_links), source='frontier')
+                await self.queue_products(output, product_links)
+                if complete:
+                    return
+                page_number = listed_pages + 1
+
+        if catalog is not None and sub_category_name in catalog.products:
+            product_links = catalog.products[sub_category_name]
+            log('listing', f"Found {len(product_links)} product links via {catalog.source} for subcategory: {sub_category_link}",
+                url=sub_category_link, products=len(product_links), source=catalog.source)
+            if frontier is not None:
+                frontier.add_listing_page(sub_category_name, 1, product_links, last=True)
+            await self.queue_products(output, product_links)
+            return
+
+        while True:
+            page_url = self.profile.listing_url(sub_category_link, page_number)
+            try:
+                page = await self.fetch(page_url, (self.profile.listing_marker,))
+                product_links, has_next_page = await asyncio.to_thread(parse_listing_page, page.text, self.profile)
+            except Exception as e:
+                log('listing_error', f"Error fetching listing page {page_url}: {e}", url=page_url, error=str(e))
+                self.context.dead_letter('listing', sub_category_link, e, sub_category_name)
+                return
+
+            if not product_links:
+                log('listing', f"No product links found on page {page_number} for subcategory: {sub_category_link}",
+                    url=sub_category_link, page=page_number, products=0)
+                break
+            log('listing', f"Found {len(product_links)} product links on page {page_number} for subcategory: {sub_category_link}",
+                url=sub_category_link, page=page_number, products=len(product_links))
+
+            if frontier is not None:
+                frontier.add_listing_page(sub_category_name, page_number, product_links, last=not has_next_page)
+            await self.queue_products(output, product_links)
+
+            if not has_next_page:
+                log('listing', f"No more pages found for subcategory: {sub_category_link}",
+                    url=sub_category_link, page=page_number)
+                break
+            page_number += 1
+        if frontier is not None:
+            frontier.finish_listing(sub_category_name)
+
+    async def queue_products(self, output, product_links):
+        for link in product_links:
+            if not output.should_scrape(link):
+                log('skipped', f"Link already scraped: {link}", url=link)
+                continue
+            record = self.context.catalog_record(link)
+            if record is not None:
+                # Complete Store API data goes straight to the sink, no page fetch or parse
+                await self.sink_queue.put((output, link, record, None))
+            else:
+                await self.fetch_queue.put((output, link))
+
+    async def fetch_worker(self):
+        while (item := await self.fetch_queue.get()) is not DONE:
+            output, link = item
+            try:
+                if self.context.frontier is not None:
+                    self.context.frontier.mark_in_flight(output.name, link)
+                page = await self.fetch(link, (self.profile.product_marker,), output.request_headers(link))
+                if page.status == 304:
+                    output.mark_unchanged(link)
+                    output.log_link(link)
+                    continue
+                log('product_page', f"Opened product page: {link} ({page.engine})", url=link, engine=page.engine)
+                await self.parse_queue.put((output, link, page))
+            except Exception as e:
+                log('product_error', f"Error processing link {link}: {e}", url=link, error=str(e))
+                self.context.dead_letter('product', link, e, output.name)
+        await self.fetch_queue.put(DONE)
+
+    async def parse_worker(self):
+        while (item := await self.parse_queue.get()) is not DONE:
+            output, link, page = item
+            try:
+                if self.context.cpu is not None:
+                    record = await asyncio.wrap_future(self.context.cpu.parse(page.text, link, self.profile.product_fields))
+                else:
+                    record = await asyncio.to_thread(parse_product, page.text, link, self.profile.product_fields)
+                await self.sink_queue.put((output, link, record, page.headers))
+            except Exception as e:
+                log('parse_error', f"Failed to scrape product data from {link}. Error: {e}", url=link, error=str(e))
+        await self.parse_queue.put(DONE)
+
+    async def sink_worker(self):
+        while (item := await self.sink_queue.get()) is not DONE:
+            output, link, record, response_headers = item
+            try:
+                output.write_product(record, response_headers)
+                output.log_link(link)
+            except Exception as e:
+                log('sink_error', f"Failed to write product {link}. Error: {e}", url=link, error=str(e))
+
+    async def stage(self, worker, count, next_queue):
+        """Run `count` copies of a stage worker, then tell the next stage it is done."""
+        await asyncio.gather(*(worker() for _ in range(count)))
+        await next_queue.put(DONE)
+
+    async def run(self, sub_category_links):
+        """Crawl every (link, name) subcategory pair and save one workbook per subcategory."""
+        # asyncio.to_thread's default pool has at most 32 threads, which would cap the concurrency
+        asyncio.get_running_loop().set_default_executor(
+            ThreadPoolExecutor(self.concurrency + self.parse_workers, thread_name_prefix='pipeline'))
+        stages = asyncio.gather(
+            self.stage(self.fetch_worker, self.concurrency, self.parse_queue),
+            self.stage(self.parse_worker, self.parse_workers, self.sink_queue),
+            self.sink_worker(),
+        )
+        try:
+            await asyncio.gather(*(self.discover(link, name) for link, name in sub_category_links))
+            await self.fetch_queue.put(DONE)
+            await stages
+        finally:
+            # Also runs when the crawl is cancelled, so the rows written so far are kept
+            stages.cancel()
+            for output in self.outputs.values():
+                output.save()
+
+
+def run_pipeline(context, sub_category_links, **options):
+    """Run the crawl pipeline to completion from synchronous code."""
+    asyncio.run(CrawlPipeline(context, **options).run(sub_category_links))
@@ -0,0 +1,280 @@
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+from metrics import log, metrics
+
+# Statuses worth retrying: rate limiting and server-side trouble
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delta-seconds or an HTTP date), or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_transient(error):
+    """True for errors another attempt may fix: timeouts, dropped connections, 429/5xx, browser waits."""
+    import requests
+
+    if isinstance(error, requests.HTTPError):
+        return error.response is not None and error.response.status_code in RETRYABLE_STATUSES
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    # Selenium is imported lazily, so match its timeout and driver errors by name
+    return any(cls.__name__ in ('TimeoutException', 'WebDriverException') for cls in type(error).__mro__)
+
+
+def retry_after_of(error):
+    response = getattr(error, 'response', None)
+    if response is not None and hasattr(response, 'headers'):
+        return parse_retry_after(response.headers.get('Retry-After'))
+    return None
+
+
+@dataclass
+class RetryPolicy:
+    """How long to wait for a response and how to back off between attempts."""
+    attempts: int = 4
+    base_delay: float = 0.5
+    max_delay: float = 30.0
+    connect_timeout: float = 5.0
+    read_timeout: float = 20.0
+
+    @property
+    def timeout(self):
+        """The (connect, read) timeout pair for requests."""
+        return (self.connect_timeout, self.read_timeout)
+
+    def delay(self, attempt, retry_after=None):
+        """Full-jitter exponential backoff, but never sooner than the server's Retry-After."""
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if retry_after is not None:
+            return min(self.max_delay, max(retry_after, backoff))
+        return backoff
+
+
+class CircuitBreaker:
+    """Stop sending requests to one host while most recent requests fail.
+
+    The breaker opens when at least `threshold` of the last `window` results
+    (and at least `min_requests` of them) were failures, and stays open for
+    `cooldown` seconds. Callers block in wait() while it is open, so the whole
+    pool pauses instead of hammering a host that is struggling. After the
+    cooldown one failure is enough to open it again.
+    """
+
+    def __init__(self, window=20, threshold=0.5, min_requests=10, cooldown=30.0):
+        self.threshold = threshold
+        self.min_requests = min_requests
+        self.cooldown = cooldown
+        self.results = deque(maxlen=window)
+        self.open_until = 0.0
+        self.half_open = False
+        self._lock = threading.Lock()
+
+    def wait(self):
+        while True:
+            with self._lock:
+                remaining = self.open_until - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(remaining)
+
+    def record(self, ok):
+        """Record one result and return True if it opened the breaker."""
+        with self._lock:
+            self.results.append(ok)
+            if ok:
+                self.half_open = False
+                return False
+            failures = self.results.count(False)
+            if self.half_open or (len(self.results) >= self.min_requests
+                                  and failures / len(self.results) >= self.threshold):
+                self.open_until = time.monotonic() + self.cooldown
+                self.half_open = True
+                self.results.clear()
+                return True
+            return False
+
+
+class TokenBucket:
+    """Allow `rate` acquisitions per second, with bursts of up to `capacity`.
+
+    Shared by threads and by the asyncio pipeline: each caller reserves a token
+    under a lock and then sleeps until its token is due, in its own way.
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Take the next token and return how many seconds to wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def wait(self):
+        delay = self.reserve()
+        if delay:
+            time.sleep(delay)
+
+    async def acquire(self):
+        delay = self.reserve()
+        if delay:
+            await asyncio.sleep(delay)
+
+
+class HostRateLimits:
+    """One TokenBucket per host, so pages and images from a host share one request budget."""
+
+    def __init__(self, rate=2.0, capacity=4):
+        self.rate = rate
+        self.capacity = capacity
+        self.buckets = {}
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(self.rate, self.capacity)
+            return self.buckets[host]
+
+
+class HostBreakers:
+    """One CircuitBreaker per host, created on first use."""
+
+    def __init__(self, **options):
+        self.options = options
+        self.breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self.breakers:
+                self.breakers[host] = CircuitBreaker(**self.options)
+            return self.breakers[host]
+
+
+def with_retries(url, call, policy=None, breakers=None):
+    """Run call() for a URL, retrying transient errors with backoff behind the host's circuit breaker."""
+    policy = policy or RetryPolicy()
+    breaker = breakers.get(url) if breakers is not None else None
+    for attempt in range(policy.attempts):
+        if breaker is not None:
+            breaker.wait()
+        try:
+            result = call()
+        except Exception as e:
+            transient = is_transient(e)
+            if breaker is not None and transient and breaker.record(False):
+                metrics.count('circuit_open')
+                log('circuit_open', f"Pausing requests to {urlsplit(url).netloc} for {breaker.cooldown:.0f}s "
+                    f"after repeated failures", host=urlsplit(url).netloc, cooldown=breaker.cooldown)
+            if not transient or attempt == policy.attempts - 1:
+                raise
+            delay = policy.delay(attempt, retry_after_of(e))
+            metrics.count('retries')
+            log('retry', f"Attempt {attempt + 1} for {url} failed ({e}), retrying in {delay:.1f}s",
+                url=url, attempt=attempt + 1, delay=round(delay, 3), error=str(e))
+            time.sleep(delay)
+        else:
+            if breaker is not None:
+                breaker.record(True)
+            return result
+
+
+class RetryingFetcher:
+    """Wrap a fetcher so every fetch gets retries, backoff and the per-host circuit breaker."""
+
+    def __init__(self, inner, policy=None, breakers=None):
+        self.inner = inner
+        self.name = inner.name
+        self.policy = policy or RetryPolicy()
+        self.breakers = breakers if breakers is not None else HostBreakers()
+
+    def fetch(self, url, markers=(), headers=None):
+        return with_retries(url, lambda: self.inner.fetch(url, markers, headers), self.policy, self.breakers)
+
+    def close(self):
+        self.inner.close()
+
+
+class DeadLetters:
+    """Append-only JSON-lines list of URLs that still failed after every retry.
+
+    Each entry records what kind of URL it was (product, listing, image), the
+    subcategory it belongs to and the last error, so the failures can be
+    retried in bulk later.
+    """
+
+    def __init__(self, path='dead_letters.jsonl'):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def add(self, kind, url, error, sub_category=None):
+        entry = {'ts': round(time.time(), 3), 'kind': kind, 'url': url, 'sub_category': sub_category,
+                 'error': str(error)}
+        with self._lock, open(self.path, 'a', encoding='utf-8') as file:
+            file.write(json.dumps(entry) + '\n')
+        metrics.count('dead_letters')
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return []
+        entries = []
+        with open(self.path, encoding='utf-8') as file:
+            for line in file:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    continue
+        return entries
+
+    def entries(self, kind=None):
+        """Return the recorded failures (of one kind), latest entry per URL."""
+        latest = {}
+        for entry in self._read():
+            if kind is None or entry['kind'] == kind:
+                latest[entry['url']] = entry
+        return list(latest.values())
+
+    def remove(self, retried):
+        """Drop entries that have been retried, keeping any failure recorded again since.
+
+        Call this once the retry has finished, so a crash mid-retry loses nothing.
+        """
+        retried_at = {(entry['kind'], entry['url']): entry['ts'] for entry in retried}
+        with self._lock:
+            remaining = [entry for entry in self._read()
+                         if entry['ts'] > retried_at.get((entry['kind'], entry['url']), -1)]
+            if os.path.exists(self.path):
+                tmp_path = f'{self.path}.tmp'
+                with open(tmp_path, 'w', encoding='utf-8') as file:
+                    file.writelines(json.dumps(entry) + '\n' for entry in remaining)
+                os.replace(tmp_path, self.path)
@@ -0,0 +1,94 @@
+import gzip
+import hashlib
+import json
+import os
+import time
+
+from requests.structures import CaseInsensitiveDict
+
+from fetcher import FetchResult
+from metrics import metrics
+
+
+class CacheMiss(LookupError):
+    """Replay asked for a URL the cache never stored."""
+
+
+class ResponseCache:
+    """Raw pages on disk, one gzipped JSON file (text, status, headers) per URL.
+
+    Files are named by the hash of the requested URL and spread over 256
+    subdirectories. Writes go to a temporary file renamed into place, so a
+    killed crawl never leaves a torn entry. A later write of the same URL
+    replaces the entry.
+    """
+
+    def __init__(self, directory='http_cache', compresslevel=6):
+        self.directory = directory
+        self.compresslevel = compresslevel
+
+    def path(self, url):
+        digest = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest[2:34] + '.json.gz')
+
+    def get(self, url):
+        """Return the cached FetchResult of a URL, or None."""
+        try:
+            with gzip.open(self.path(url), 'rt', encoding='utf-8') as file:
+                entry = json.load(file)
+        except FileNotFoundError:
+            return None
+        return FetchResult(entry['final_url'], entry['status'], entry['text'], CaseInsensitiveDict(entry['headers']),
+                           entry['engine'])
+
+    def put(self, url, result):
+        path = self.path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        entry = {'url': url, 'final_url': result.url, 'status': result.status, 'headers': dict(result.headers),
+                 'engine': result.engine, 'fetched_at': round(time.time(), 3), 'text': result.text}
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with gzip.open(tmp_path, 'wt', encoding='utf-8', compresslevel=self.compresslevel) as file:
+            json.dump(entry, file, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+
+class CachingFetcher:
+    """Write every page another fetcher returns through to a ResponseCache."""
+
+    def __init__(self, inner, cache):
+        self.inner = inner
+        self.name = inner.name
+        self.cache = cache
+
+    def fetch(self, url, markers=(), headers=None):
+        result = self.inner.fetch(url, markers, headers)
+        if result.status == 200:
+            self.cache.put(url, result)
+        return result
+
+    def close(self):
+        self.inner.close()
+
+
+class ReplayFetcher:
+    """Serve pages from a ResponseCache only, never touching the network.
+
+    Conditional request headers are ignored, so a replayed crawl re-extracts
+    every page it finds.
+    """
+
+    name = 'replay'
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def fetch(self, url, markers=(), headers=None):
+        result = self.cache.get(url)
+        if result is None:
+            raise CacheMiss(f"{url} is not in the response cache at {self.cache.directory}")
+        metrics.count('pages')
+        metrics.count('bytes', len(result.text))
+        return result
+
+    def close(self):
+        pass
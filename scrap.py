@@ -2,8 +2,9 @@ import undetected_chromedriver as uc
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from bs4 import BeautifulSoup
 import requests
+from extractor import extract_product
+from resilience import RetryPolicy, with_retries
 import os
 import time
 import xlsxwriter
@@ -31,53 +32,30 @@ def download_image(image_url, image_name, retries=3):
     headers = {
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
     }
-    attempt = 0
-    while attempt < retries:
-        try:
-            response = requests.get(image_url, headers=headers, stream=True)
-            response.raise_for_status()
-            with open(os.path.join(image_folder, image_name), 'wb') as file:
-                for chunk in response.iter_content(chunk_size=8192):
-                    file.write(chunk)
-            return os.path.join(image_folder, image_name)
-        except requests.RequestException as e:
-            attempt += 1
-            print(f"Attempt {attempt} failed to download image from {image_url}. Error: {e}")
-            time.sleep(2)  # Wait before retrying
-    return 'N/A'
+    policy = RetryPolicy(attempts=retries)
+
+    def download():
+        response = requests.get(image_url, headers=headers, stream=True, timeout=policy.timeout)
+        response.raise_for_status()
+        with open(os.path.join(image_folder, image_name), 'wb') as file:
+            for chunk in response.iter_content(chunk_size=8192):
+                file.write(chunk)
+        return os.path.join(image_folder, image_name)
+
+    try:
+        return with_retries(image_url, download, policy)
+    except requests.RequestException as e:
+        print(f"Failed to download image from {image_url}. Error: {e}")
+        return 'N/A'
 
 def scrape_product_data(driver):
     try:
-        soup = BeautifulSoup(driver.page_source, 'html.parser')
-
-        # Extract data using BeautifulSoup
-        category = soup.find(class_='single-product-category')
-        title = soup.find(class_='product_title entry-title')
-        price_element = soup.find(class_='woocommerce-Price-amount')
-        sku_wrapper = soup.find(class_='sku_wrapper')
-        sku = soup.find(class_='sku')
-        description_div = soup.find('div', id='tab-description')
-        size = soup.find(class_='woocommerce-product-attributes-item__value')
-        image_tag = soup.find('img', class_='wp-post-image')  # Extract image with this class
-
-        # Extract text with default values if elements are not found
-        category_text = category.get_text(strip=True) if category else 'N/A'
-        title_text = title.get_text(strip=True) if title else 'N/A'
-        
-        if price_element:
-            price_currency = price_element.find(class_='woocommerce-Price-currencySymbol').get_text(strip=True) if price_element.find(class_='woocommerce-Price-currencySymbol') else 'N/A'
-            price_value = price_element.find('bdi').get_text(strip=True) if price_element.find('bdi') else 'N/A'
-            price_text = f"{price_currency} {price_value}"
-        else:
-            price_text = 'N/A'
-        
-        sku_combined = f"{sku_wrapper.get_text(strip=True)} {sku.get_text(strip=True)}" if sku_wrapper and sku else 'N/A'
-        description_text = description_div.find('p').get_text(strip=True) if description_div and description_div.find('p') else 'N/A'
-        size_text = size.get_text(strip=True) if size else 'N/A'
-        
+        record = extract_product(driver.page_source, driver.current_url)
+        category_text, title_text, price_text, sku_combined, description_text, size_text = record.values()
+
         # Extract image URL and download the image
-        if image_tag:
-            image_url = image_tag['src']
+        if record.image_url:
+            image_url = record.image_url
             image_name = image_url.split('/')[-1]
             image_path = download_image(image_url, image_name)
         else:
@@ -0,0 +1,329 @@
+import csv
+import json
+import os
+from concurrent.futures import Future
+from dataclasses import asdict
+from decimal import Decimal
+
+import xlsxwriter
+
+from metrics import log, metrics
+
+HEADERS = ['Category', 'Title', 'Price', 'SKU Combined', 'Description', 'Size', 'Image']
+
+# Columns of the line-delimited and columnar outputs: the record fields, with the image as its URL
+FIELDS = ['category', 'title', 'price', 'sku', 'description', 'size', 'image_url', 'url', 'currency', 'price_amount']
+
+
+class ExcelSink:
+    """Stream product rows into an .xlsx file with constant memory.
+
+    Rows go straight to an xlsxwriter workbook in constant_memory mode, so memory
+    does not grow with the number of rows. The workbook is written to a temporary
+    file and renamed into place on close(), so `path` is always a complete file.
+    Every row is also appended to a JSON-lines checkpoint, handed to the OS as it
+    is written and fsynced every `checkpoint_every` rows. If the process is
+    killed before close(), the next sink opened on the same path replays that
+    checkpoint and no rows are lost.
+
+    The image may be a path or a Future from the image stage: the row is written
+    at once and the image is placed in it when the download finishes.
+    With `recover=False` a leftover checkpoint is discarded instead, for callers
+    that rebuild every row from their own journal.
+    """
+
+    extension = '.xlsx'
+
+    def __init__(self, path, sheet_name='Sheet1', checkpoint_every=25, recover=True):
+        self.path = path
+        self.tmp_path = f'{path}.tmp'
+        self.checkpoint_path = f'{path}.checkpoint.jsonl'
+        self.checkpoint_every = checkpoint_every
+        self.closed = False
+
+        recovered = read_checkpoint(self.checkpoint_path) if recover else []
+        self.workbook = xlsxwriter.Workbook(self.tmp_path, {'constant_memory': True})
+        self.sheet = self.workbook.add_worksheet(sheet_name[:31])  # Excel caps sheet names at 31 characters
+        self.sheet.write_row(0, 0, HEADERS)
+        self.sheet.set_column(6, 6, 20)  # Adjust the width as needed
+        self.row = 1
+
+        for values, image_path in recovered:
+            self.sheet.write_row(self.row, 0, values)
+            self._insert_image(self.row, image_path)
+            self.row += 1
+        if recovered:
+            log('recovered', f"Recovered {len(recovered)} rows from {self.checkpoint_path}",
+                rows=len(recovered), path=self.checkpoint_path)
+        self._checkpoint = open(self.checkpoint_path, 'a' if recover else 'w', encoding='utf-8')
+        self._checkpointed_rows = len(recovered)
+        self._unflushed = 0
+        self._pending_images = []  # (sheet row, checkpoint row, Future)
+
+    def _insert_image(self, row, image_path):
+        if image_path and image_path != 'N/A':
+            self.sheet.insert_image(row, 6, image_path)
+
+    def _checkpoint_line(self, data):
+        self._checkpoint.write(json.dumps(data) + '\n')
+        self._checkpoint.flush()  # Survives the process being killed; fsync below survives the machine
+        self._unflushed += 1
+        if self._unflushed >= self.checkpoint_every:
+            self.flush()
+
+    def write(self, record, image):
+        """Append one product row and checkpoint it."""
+        values = record.values()
+        with metrics.timer('excel.write'):
+            self.sheet.write_row(self.row, 0, values)
+        if isinstance(image, Future):
+            self._checkpoint_line({'values': values, 'image': None})
+            self._pending_images.append((self.row, self._checkpointed_rows, image))
+        else:
+            self._checkpoint_line({'values': values, 'image': image})
+            self._insert_image(self.row, image)
+        self._checkpointed_rows += 1
+        self.row += 1
+        self.place_images()
+
+    def place_images(self, wait=False):
+        """Insert the images whose downloads have finished (or all of them when `wait`)."""
+        still_pending = []
+        for row, checkpoint_row, future in self._pending_images:
+            if wait or future.done():
+                image_path = future.result()
+                self._insert_image(row, image_path)
+                self._checkpoint_line({'row': checkpoint_row, 'image': image_path})
+            else:
+                still_pending.append((row, checkpoint_row, future))
+        self._pending_images = still_pending
+
+    def flush(self):
+        """Force the checkpoint rows written so far onto disk."""
+        os.fsync(self._checkpoint.fileno())
+        self._unflushed = 0
+
+    def close(self):
+        """Finish the workbook, move it into place and drop the checkpoint."""
+        if self.closed:
+            return
+        self.closed = True
+        self.place_images(wait=True)
+        self.flush()
+        with metrics.timer('excel.save'):
+            self.workbook.close()
+        os.replace(self.tmp_path, self.path)
+        self._checkpoint.close()
+        os.remove(self.checkpoint_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_checkpoint(checkpoint_path):
+    """Read the (values, image_path) rows left behind by an interrupted run."""
+    rows = []
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path, encoding='utf-8') as file:
+            for line in file:
+                try:
+                    data = json.loads(line)
+                except ValueError:
+                    break  # A torn last line from a crash mid-write
+                if 'row' in data:
+                    rows[data['row']][1] = data['image']
+                else:
+                    rows.append([data['values'], data['image']])
+    # Images that never finished downloading, or were removed since, are left out
+    return [(values, image_path if image_path and os.path.exists(image_path) else 'N/A')
+            for values, image_path in rows]
+
+
+class JsonlSink:
+    """Stream product records to a JSON-lines file, one object per row.
+
+    Like ExcelSink, rows go to `path.tmp`, which is renamed into place on
+    close(). Text sinks store the image URL rather than a thumbnail, so they
+    never wait for downloads; build an image-embedded workbook from them with
+    export.py when one is needed. With `recover=True` the complete rows of a
+    temporary file left by a killed run are kept.
+    """
+
+    extension = '.jsonl'
+
+    def __init__(self, path, sheet_name=None, recover=True, flush_every=25):
+        self.path = path
+        self.tmp_path = f'{path}.tmp'
+        self.flush_every = flush_every
+        self.closed = False
+        self.rows = self._recover() if recover and os.path.exists(self.tmp_path) else 0
+        self.file = open(self.tmp_path, 'a' if self.rows else 'w', encoding='utf-8', newline='')
+        if self.rows:
+            log('recovered', f"Recovered {self.rows} rows from {self.tmp_path}", rows=self.rows, path=self.tmp_path)
+
+    def _recover(self):
+        """Return how many complete rows the temporary file of a killed run keeps."""
+        truncate_torn_line(self.tmp_path)
+        with open(self.tmp_path, encoding='utf-8') as file:
+            return sum(1 for line in file if line.strip())
+
+    def write(self, record, image=None):
+        self.file.write(json.dumps(row_of(record), ensure_ascii=False) + '\n')
+        self._written()
+
+    def _written(self):
+        self.rows += 1
+        if self.rows % self.flush_every == 0:
+            self.file.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class CsvSink(JsonlSink):
+    """Stream product records to a CSV file with a header row; see JsonlSink."""
+
+    extension = '.csv'
+
+    def __init__(self, path, sheet_name=None, recover=True, flush_every=25):
+        super().__init__(path, sheet_name, recover, flush_every)
+        self.writer = csv.DictWriter(self.file, FIELDS)
+        if self.file.tell() == 0:
+            self.writer.writeheader()
+
+    def _recover(self):
+        # Quoted fields may hold newlines, so count rows with the csv reader rather than by line
+        truncate_torn_line(self.tmp_path)
+        with open(self.tmp_path, encoding='utf-8', newline='') as file:
+            return max(0, sum(1 for _ in csv.reader(file)) - 1)  # Minus the header
+
+    def write(self, record, image=None):
+        self.writer.writerow(row_of(record))
+        self._written()
+
+
+class ParquetSink:
+    """Stream product records to a Parquet file in row groups of `batch_rows` (requires pyarrow).
+
+    Rows are buffered and written as one row group per batch to `path.tmp`,
+    which is renamed into place on close(). A Parquet file is only readable once
+    closed, so a killed run leaves nothing to recover; use it next to a frontier
+    or another sink.
+    """
+
+    extension = '.parquet'
+
+    def __init__(self, path, sheet_name=None, recover=True, batch_rows=1000):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.pa = pa
+        self.path = path
+        self.tmp_path = f'{path}.tmp'
+        self.batch_rows = batch_rows
+        self.closed = False
+        # price_amount is a real decimal column; everything else stays text
+        self.schema = pa.schema([(name, pa.decimal128(18, 4) if name == 'price_amount' else pa.string())
+                                 for name in FIELDS])
+        self.writer = pq.ParquetWriter(self.tmp_path, self.schema, compression='zstd')
+        self.batch = []
+
+    def write(self, record, image=None):
+        row = row_of(record)
+        if row['price_amount'] is not None:
+            row['price_amount'] = Decimal(row['price_amount']).quantize(Decimal('0.0001'))
+        self.batch.append(row)
+        if len(self.batch) >= self.batch_rows:
+            self.flush()
+
+    def flush(self):
+        if self.batch:
+            self.writer.write_table(self.pa.Table.from_pylist(self.batch, schema=self.schema))
+            self.batch = []
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.flush()
+        self.writer.close()
+        os.replace(self.tmp_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def truncate_torn_line(path):
+    """Cut off a last line left half-written by a crash."""
+    with open(path, 'rb+') as file:
+        data = file.read()
+        file.truncate(data.rfind(b'\n') + 1)
+
+
+def row_of(record):
+    """The FIELDS of a ProductRecord as a dict."""
+    data = asdict(record)
+    return {name: data.get(name) for name in FIELDS}
+
+
+def record_of(row):
+    """Turn a row read back from a JSONL, CSV or Parquet output into a ProductRecord."""
+    from extractor import ProductRecord
+
+    price_amount = row.get('price_amount')
+    record = ProductRecord(image_url=row.get('image_url') or None, url=row.get('url') or None,
+                           currency=row.get('currency') or None,
+                           price_amount=str(price_amount) if price_amount not in (None, '') else None)
+    for name in ('category', 'title', 'price', 'sku', 'description', 'size'):
+        if row.get(name):
+            setattr(record, name, row[name])
+    return record.intern()
+
+
+# Output format name -> sink class; each takes (path, sheet_name, recover=...) and has an `extension`
+SINKS = {'xlsx': ExcelSink, 'jsonl': JsonlSink, 'csv': CsvSink, 'parquet': ParquetSink}
+
+
+def make_sink(output_format, base_path, sheet_name='Sheet1', recover=True):
+    """Open the sink for an output format at `base_path` plus the format's extension."""
+    if output_format not in SINKS:
+        raise ValueError(f"Unknown output format: {output_format} (expected one of {', '.join(SINKS)})")
+    sink_class = SINKS[output_format]
+    return sink_class(base_path + sink_class.extension, sheet_name, recover=recover)
+
+
+def read_rows(path):
+    """Yield the rows of a JSONL, CSV or Parquet output as dicts of FIELDS."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.jsonl':
+        with open(path, encoding='utf-8') as file:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+    elif extension == '.csv':
+        with open(path, encoding='utf-8', newline='') as file:
+            yield from csv.DictReader(file)
+    elif extension == '.parquet':
+        import pyarrow.parquet as pq
+
+        parquet_file = pq.ParquetFile(path)
+        for batch in parquet_file.iter_batches():
+            yield from batch.to_pylist()
+    else:
+        raise ValueError(f"Cannot read rows from {path}")
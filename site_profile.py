@@ -0,0 +1,74 @@
+import json
+import os
+from dataclasses import dataclass, field, fields, replace
+
+from extractor import PRODUCT_FIELDS, FieldSelector
+from fetcher import CATEGORY_MARKER, LISTING_MARKER, PRODUCT_MARKER
+
+
+@dataclass
+class SiteProfile:
+    """Everything site specific about a crawl: where it starts, how pages are laid out and how hard to hit it.
+
+    The defaults describe capraleo.com. Crawl settings left as None fall back
+    to the SCRAPER_* environment variables. `fields` overrides product field
+    selectors by name, e.g. {"title": {"class_": "product-name"}}, using the
+    FieldSelector attributes (tag, class_, id, within, attr).
+    """
+    name: str = 'capraleo'
+    base_url: str = 'https://capraleo.com/'
+    output_dir: str = ''  # Outputs, links files and journals go here
+    discovery: str = None
+    ingest: str = None
+    concurrency: int = None
+    per_host: int = None
+    rate: float = None
+    category_links: str = 'a.ekit_badge_left'  # CSS selector of the category links on the start page
+    listing_items: str = '.products.columns-4 li'  # One element per product on a listing page
+    next_page: str = 'a.next.page-numbers'
+    pagination: str = '{link}/page/{page}/'
+    category_marker: str = CATEGORY_MARKER  # Classes the browser waits for before reading a page
+    listing_marker: str = LISTING_MARKER
+    product_marker: str = PRODUCT_MARKER
+    blocked_urls: list = field(default_factory=list)  # Extra URL patterns a lean browser never loads
+    fields: dict = field(default_factory=dict)
+
+    def __post_init__(self):
+        defaults = {selector.name: selector for selector in PRODUCT_FIELDS}
+        unknown = set(self.fields) - set(defaults)
+        if unknown:
+            raise ValueError(f"Unknown product fields in site profile {self.name}: {', '.join(sorted(unknown))}")
+        self.product_fields = tuple(replace(selector, **self.fields[selector.name])
+                                    if selector.name in self.fields else selector
+                                    for selector in PRODUCT_FIELDS)
+
+    def setting(self, name, variable, default, kind=str):
+        """The profile's value for a crawl setting, else the environment variable's, else the default."""
+        value = getattr(self, name)
+        if value is None:
+            value = os.environ.get(variable, default)
+        return kind(value)
+
+    def listing_url(self, link, page):
+        return self.pagination.format(link=link, page=page)
+
+
+def load_profile(path):
+    """Read a SiteProfile from a JSON or YAML file."""
+    with open(path, encoding='utf-8') as file:
+        if path.lower().endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise RuntimeError(f"PyYAML is needed to read {path}; install it or use a JSON profile")
+            data = yaml.safe_load(file)
+        else:
+            data = json.load(file)
+    known = {profile_field.name for profile_field in fields(SiteProfile)}
+    unknown = set(data) - known
+    if unknown:
+        raise ValueError(f"Unknown settings in site profile {path}: {', '.join(sorted(unknown))}")
+    data.setdefault('name', os.path.splitext(os.path.basename(path))[0])
+    for name, options in data.get('fields', {}).items():
+        FieldSelector(name, **options)  # Fails early on a misspelled selector attribute
+    return SiteProfile(**data)
@@ -0,0 +1,95 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from dataclasses import asdict
+
+from extractor import ProductRecord
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS products (
+    url TEXT PRIMARY KEY,
+    fetched_at REAL NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    content_hash TEXT NOT NULL,
+    record TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS memberships (
+    sub_category TEXT NOT NULL,
+    url TEXT NOT NULL REFERENCES products(url),
+    PRIMARY KEY (sub_category, url)
+);
+'''
+
+
+def content_hash(record):
+    """Hash the extracted fields, so cosmetic page changes do not count as product changes."""
+    data = asdict(record)
+    data.pop('url', None)
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class StateStore:
+    """SQLite store of every scraped product, used to re-crawl incrementally.
+
+    Each product keeps its last fetch time, the ETag/Last-Modified it was served
+    with and a hash of its extracted fields. A re-run sends conditional requests,
+    only re-parses pages that changed, and rebuilds the full output from here.
+    """
+
+    def __init__(self, path='crawl_state.db'):
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def conditional_headers(self, url):
+        """Return If-None-Match/If-Modified-Since headers for a product we already have."""
+        with self._lock:
+            row = self.connection.execute('SELECT etag, last_modified FROM products WHERE url = ?', (url,)).fetchone()
+        headers = {}
+        if row:
+            etag, last_modified = row
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+        return headers
+
+    def save(self, sub_category, record, response_headers=None):
+        """Store a freshly parsed record and return True if its fields changed."""
+        response_headers = response_headers or {}
+        new_hash = content_hash(record)
+        with self._lock, self.connection:
+            row = self.connection.execute('SELECT content_hash FROM products WHERE url = ?', (record.url,)).fetchone()
+            self.connection.execute(
+                'INSERT INTO products (url, fetched_at, etag, last_modified, content_hash, record) VALUES (?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT(url) DO UPDATE SET fetched_at = excluded.fetched_at, etag = excluded.etag, '
+                'last_modified = excluded.last_modified, content_hash = excluded.content_hash, record = excluded.record',
+                (record.url, time.time(), response_headers.get('ETag'), response_headers.get('Last-Modified'),
+                 new_hash, json.dumps(asdict(record))))
+            self._add_membership(sub_category, record.url)
+        return row is None or row[0] != new_hash
+
+    def touch(self, sub_category, url):
+        """Record that a product was re-checked and found unchanged (e.g. a 304)."""
+        with self._lock, self.connection:
+            self.connection.execute('UPDATE products SET fetched_at = ? WHERE url = ?', (time.time(), url))
+            self._add_membership(sub_category, url)
+
+    def _add_membership(self, sub_category, url):
+        self.connection.execute('INSERT OR IGNORE INTO memberships (sub_category, url) VALUES (?, ?)', (sub_category, url))
+
+    def records(self, sub_category):
+        """Yield the stored records of a subcategory in the order they were first seen."""
+        with self._lock:
+            rows = self.connection.execute(
+                'SELECT products.record FROM memberships JOIN products ON products.url = memberships.url '
+                'WHERE memberships.sub_category = ? ORDER BY memberships.rowid', (sub_category,)).fetchall()
+        for (data,) in rows:
+            yield ProductRecord(**json.loads(data))
+
+    def close(self):
+        self.connection.close()
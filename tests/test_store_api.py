@@ -0,0 +1,81 @@
+"""Store API ingest against recorded JSON, served by a local HTTP server."""
+import json
+import os
+import threading
+from dataclasses import replace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+import pytest
+
+from discovery import discover_catalog, is_complete, record_from_store_item
+from extractor import PRODUCT_FIELDS, extract_product
+from fetcher import HttpFetcher
+
+FIXTURES = os.path.join(os.path.dirname(__file__), '..', 'fixtures')
+PRODUCT_URL = 'https://capraleo.com/product/bone-nibbler/'
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES, name), encoding='utf-8') as file:
+        return file.read()
+
+
+@pytest.fixture(scope='module')
+def store_items():
+    return {item['permalink']: item for item in json.loads(read_fixture('store_api_products.json'))}
+
+
+@pytest.fixture(scope='module')
+def store_api():
+    """Base URL of a local server answering the Store API products and categories endpoints from the fixtures."""
+    bodies = {'/wp-json/wc/store/v1/products': read_fixture('store_api_products.json').encode('utf-8'),
+              '/wp-json/wc/store/v1/products/categories': read_fixture('store_api_categories.json').encode('utf-8')}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = bodies.get(urlsplit(self.path).path.rstrip('/'))
+            if body is None or 'page=1' not in self.path:
+                body = b'[]'  # Everything fits on the first page
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_address[1]}/'
+    server.shutdown()
+
+
+def test_discovery_lists_products_under_their_parent_categories(store_api):
+    fetcher = HttpFetcher()
+    try:
+        catalog = discover_catalog(fetcher, store_api, 'store-api')
+    finally:
+        fetcher.close()
+    assert catalog.source == 'store-api'
+    assert len(catalog.items) == 3
+    assert catalog.products['bone-instruments'] == catalog.products['orthopedic'] == list(catalog.items)
+    assert catalog.category_links['orthopedic'] == 'https://capraleo.com/product-category/orthopedic/'
+
+
+def test_record_matches_product_page(store_items):
+    page = extract_product(read_fixture('product.html'), PRODUCT_URL, PRODUCT_FIELDS)
+    record = record_from_store_item(store_items[PRODUCT_URL])
+    for name in ('category', 'title', 'price', 'sku', 'description', 'size', 'url', 'currency'):
+        assert getattr(record, name) == getattr(page, name), name
+    # The page shows the 600x600 rendition of the same upload the API lists at full size
+    assert page.image_url == record.image_url.replace('.jpg', '-600x600.jpg')
+
+
+def test_is_complete(store_items):
+    records = {url: record_from_store_item(item) for url, item in store_items.items()}
+    assert is_complete(records[PRODUCT_URL])
+    assert not is_complete(records['https://capraleo.com/product/bone-cutting-forceps-liston/'])  # No price
+    assert not is_complete(records['https://capraleo.com/product/bone-curette-volkmann/'])  # No SKU
+    assert not is_complete(replace(records[PRODUCT_URL], title='N/A'))
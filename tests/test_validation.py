@@ -0,0 +1,24 @@
+"""Quality checks: which incomplete products are reported and which are fetched again."""
+from extractor import ProductRecord
+from resilience import DeadLetters
+from validation import QualityReport
+
+PRODUCT = dict(category='forceps', title='Bone Cutting Forceps', price='$ 120.00', sku='BF-1',
+               image_url='https://capraleo.com/wp-content/uploads/forceps.jpg',
+               url='https://capraleo.com/product/bone-cutting-forceps/')
+
+
+def test_missing_price_is_reported_but_not_requeued(tmp_path):
+    dead_letters = DeadLetters(str(tmp_path / 'dead_letters.jsonl'))
+    report = QualityReport(dead_letters)
+    assert report.check('forceps', ProductRecord(**dict(PRODUCT, price='N/A'))) == ['price']
+    assert report.summary()['forceps']['issues'] == {'price': 1}
+    assert report.requeued == [] and dead_letters.entries('product') == []
+
+
+def test_missing_title_is_requeued(tmp_path):
+    dead_letters = DeadLetters(str(tmp_path / 'dead_letters.jsonl'))
+    report = QualityReport(dead_letters)
+    assert report.check('forceps', ProductRecord(**dict(PRODUCT, title='N/A'))) == ['title']
+    assert report.requeued == [PRODUCT['url']]
+    assert [entry['url'] for entry in dead_letters.entries('product')] == [PRODUCT['url']]
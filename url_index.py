@@ -0,0 +1,139 @@
+import hashlib
+import math
+import mmap
+import os
+import threading
+from array import array
+from bisect import bisect_left
+from heapq import merge
+
+
+def url_key(url, prefix='', scope=''):
+    """64-bit hash of a URL without its common prefix, within a scope such as a subcategory name."""
+    url = url.strip()
+    if prefix and url.startswith(prefix):
+        url = url[len(prefix):]
+    return hashlib.blake2b(f'{scope}\0{url}'.encode(), digest_size=8).digest()
+
+
+class UrlIndex:
+    """Set of visited URLs kept as sorted 64-bit hashes, shared by every subcategory.
+
+    URLs lose the site prefix (e.g. https://capraleo.com/) before hashing and are
+    scoped, so the same product listed in two subcategories is tracked for each.
+    A URL costs 8 bytes in a sorted array instead of a ~150 byte string in a
+    set; new URLs collect in a small set that is merged into the array every
+    `merge_every` additions. Two URLs sharing a hash is a ~1 in 10^7 event at a
+    million URLs.
+
+    With a BloomFilter the index lives on disk instead, at the filter's false
+    positive rate: that fraction of unseen URLs is wrongly reported as visited.
+    """
+
+    def __init__(self, prefix='', bloom=None, merge_every=4096):
+        self.prefix = prefix
+        self.bloom = bloom
+        self.merge_every = merge_every
+        self._sorted = array('Q')
+        self._recent = set()
+        self._lock = threading.Lock()
+
+    def _key(self, url, scope):
+        return int.from_bytes(url_key(url, self.prefix, scope), 'little')
+
+    def _has(self, key):
+        if key in self._recent:
+            return True
+        position = bisect_left(self._sorted, key)
+        return position < len(self._sorted) and self._sorted[position] == key
+
+    def contains(self, url, scope=''):
+        if self.bloom is not None:
+            return url_key(url, self.prefix, scope) in self.bloom
+        key = self._key(url, scope)
+        with self._lock:
+            return self._has(key)
+
+    def add(self, url, scope=''):
+        if self.bloom is not None:
+            self.bloom.add(url_key(url, self.prefix, scope))
+            return
+        key = self._key(url, scope)
+        with self._lock:
+            if not self._has(key):
+                self._recent.add(key)
+                if len(self._recent) >= self.merge_every:
+                    self._merge()
+
+    def update(self, urls, scope=''):
+        for url in urls:
+            self.add(url, scope)
+
+    def _merge(self):
+        self._sorted = array('Q', merge(self._sorted, sorted(self._recent)))
+        self._recent = set()
+
+    def __len__(self):
+        if self.bloom is not None:
+            return self.bloom.count
+        return len(self._sorted) + len(self._recent)
+
+    def close(self):
+        if self.bloom is not None:
+            self.bloom.close()
+
+
+class BloomFilter:
+    """Bloom filter in a memory-mapped file, so visited URLs persist without being loaded into memory.
+
+    Sized for `capacity` items at `error_rate` false positives; past capacity
+    the rate climbs, and a different capacity starts a new, empty filter. Items
+    are the 8-byte keys from url_key().
+    """
+
+    HEADER = 16  # item count, then the number of hash functions
+
+    def __init__(self, path, capacity=1_000_000, error_rate=0.001):
+        self.path = path
+        bits = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.size = (bits + 7) // 8 * 8
+        hashes = max(1, round(self.size / capacity * math.log(2)))
+        length = self.HEADER + self.size // 8
+        if not os.path.exists(path) or os.path.getsize(path) != length:
+            with open(path, 'wb') as file:
+                file.write(int(0).to_bytes(8, 'little') + hashes.to_bytes(8, 'little'))
+                file.truncate(length)
+        self._file = open(path, 'r+b')
+        self._map = mmap.mmap(self._file.fileno(), length)
+        self.hashes = int.from_bytes(self._map[8:16], 'little')
+        self._lock = threading.Lock()
+
+    @property
+    def count(self):
+        return int.from_bytes(self._map[0:8], 'little')
+
+    def _positions(self, key):
+        # Double hashing: two 64-bit halves of one digest give every probe position
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def __contains__(self, key):
+        return all(self._map[self.HEADER + bit // 8] >> (bit % 8) & 1 for bit in self._positions(key))
+
+    def add(self, key):
+        with self._lock:
+            added = False
+            for bit in self._positions(key):
+                offset = self.HEADER + bit // 8
+                byte = self._map[offset]
+                if not byte >> (bit % 8) & 1:
+                    self._map[offset] = byte | 1 << (bit % 8)
+                    added = True
+            if added:
+                self._map[0:8] = (self.count + 1).to_bytes(8, 'little')
+
+    def close(self):
+        self._map.flush()
+        self._map.close()
+        self._file.close()
@@ -0,0 +1,121 @@
+import json
+import os
+import re
+import threading
+from collections import Counter
+from decimal import Decimal, InvalidOperation
+
+from metrics import log, metrics
+
+# The first number in a price, with its thousands and decimal separators
+PRICE_NUMBER = re.compile(r'\d[\d.,\s]*')  # \s includes no-break and narrow spaces
+SPACES = re.compile(r'\s')
+
+# Issues that mean the page was probably not rendered completely, so the product is worth fetching again.
+# The title is read from the product marker element; a missing price is often real (e.g. price on request)
+REQUEUE_ISSUES = {'title'}
+
+
+def parse_price(text):
+    """Split a price such as '$ $1,234.50' or '1.234,50 €' into (currency symbol, Decimal amount).
+
+    Returns (None, None) when the text holds no number. With a single kind of
+    separator, a comma followed by exactly three digits groups thousands and
+    anything else marks the decimals.
+    """
+    if not text or text == 'N/A':
+        return None, None
+    match = PRICE_NUMBER.search(text)
+    if match is None:
+        return None, None
+    number = SPACES.sub('', match.group()).rstrip('.,')
+    if '.' in number and ',' in number:
+        decimal_mark = '.' if number.rfind('.') > number.rfind(',') else ','
+    elif number.count(',') == 1 and len(number) - number.rfind(',') - 1 != 3:
+        decimal_mark = ','
+    elif number.count('.') > 1:
+        decimal_mark = ','  # Dots grouping thousands, e.g. 1.234.567
+    else:
+        decimal_mark = '.'
+    thousands_mark = ',' if decimal_mark == '.' else '.'
+    try:
+        amount = Decimal(number.replace(thousands_mark, '').replace(decimal_mark, '.'))
+    except InvalidOperation:
+        return None, None
+    symbols = (text[:match.start()] + text[match.end():]).split()
+    return (symbols[0] if symbols else None), amount
+
+
+class QualityReport:
+    """Check every product as it is written and keep per-category data quality counts.
+
+    check() fills the record's currency and price_amount from its price text
+    and returns the issues found: missing title, price, SKU or image URL, or a
+    price with no number. Whether the image was actually fetched is counted
+    when its download finishes, without waiting for it. Products missing a
+    title are added to the dead-letter list, so SCRAPER_RETRY_DEAD fetches
+    them again; the other issues are only reported.
+    """
+
+    def __init__(self, dead_letters=None):
+        self.dead_letters = dead_letters
+        self.categories = {}
+        self.requeued = []
+        self._lock = threading.Lock()
+
+    def _category(self, name):
+        if name not in self.categories:
+            self.categories[name] = {'products': 0, 'valid': 0, 'issues': Counter()}
+        return self.categories[name]
+
+    def check(self, sub_category, record, image=None):
+        """Normalize the record's price and count its issues; `image` is the thumbnail Future, if any."""
+        currency, amount = parse_price(record.price)
+        if amount is not None:
+            record.currency = record.currency or currency
+            record.price_amount = str(amount)
+            record.intern()
+        checks = (('title', record.title not in ('N/A', None, '')), ('price', amount is not None),
+                  ('sku', record.sku not in ('N/A', None, '')), ('image', bool(record.image_url)))
+        issues = [name for name, passed in checks if not passed]
+        with self._lock:
+            stats = self._category(sub_category)
+            stats['products'] += 1
+            stats['valid'] += not issues
+            stats['issues'].update(issues)
+            if REQUEUE_ISSUES.intersection(issues):
+                self.requeued.append(record.url)
+        if issues:
+            metrics.count('invalid_products')
+            log('invalid_product', f"Product {record.url} failed checks: {', '.join(issues)}",
+                url=record.url, sub_category=sub_category, issues=issues)
+            if self.dead_letters is not None and record.url and REQUEUE_ISSUES.intersection(issues):
+                self.dead_letters.add('product', record.url, f"invalid: {', '.join(issues)}", sub_category)
+        if image is not None and 'image' not in issues:
+            image.add_done_callback(lambda done: self._image_done(sub_category, done))
+        return issues
+
+    def _image_done(self, sub_category, future):
+        if future.exception() is not None or future.result() in (None, 'N/A'):
+            with self._lock:
+                self._category(sub_category)['issues']['image_fetch'] += 1
+
+    def summary(self):
+        with self._lock:
+            return {name: {'products': stats['products'], 'valid': stats['valid'],
+                           'valid_ratio': round(stats['valid'] / stats['products'], 4) if stats['products'] else None,
+                           'issues': dict(stats['issues'])}
+                    for name, stats in sorted(self.categories.items())}
+
+    def write(self, path):
+        """Write the per-category report and the URLs to re-queue as JSON, and log a table of it."""
+        summary = self.summary()
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump({'categories': summary, 'requeue': self.requeued}, file, indent=2)
+        os.replace(tmp_path, path)
+        lines = [f"Data quality ({path}):"]
+        for name, stats in summary.items():
+            issues = ', '.join(f"{issue}={count}" for issue, count in sorted(stats['issues'].items())) or 'none'
+            lines.append(f"  {name:<30} {stats['valid']:>6}/{stats['products']:<6} valid  issues: {issues}")
+        log('quality_report', '\n'.join(lines), path=path, categories=summary, requeue=len(self.requeued))